@@ -1,49 +1,181 @@
 import pandas as pd
+import numpy as np
+import plotting
 import matplotlib.pyplot as plt
 from datetime import datetime, timedelta
-from binance.client import Client
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
+from collections import deque
+import threading
+import time
+import requests
 import os
 import docker 
+import store
+import instrument
+from decode import decode_agg_trades
 
+BASE_URL = "https://api.binance.com/api/v3"
+AGG_TRADES_LIMIT = 1000
+AGG_TRADES_WEIGHT = 2
+# Binance rejects aggTrades windows of an hour or more when both bounds are sent
+SHARD_MS = 60 * 60 * 1000 - 1
 
-client = Client(docker.api_keys, docker.api_secret)
+_client = None
 
-def fetch_trades(symbol, start_time, end_time):
-    trades = []
-    while start_time < end_time:
-        new_trades = client.get_aggregate_trades(symbol=symbol, startTime=start_time, endTime=end_time, limit=1000)
-        if not new_trades:
+def get_client():
+    # Built on first use so importing this module needs no keys or network
+    global _client
+    if _client is None:
+        from binance.client import Client
+        _client = Client(docker.api_keys, docker.api_secret)
+    return _client
+
+class RestClient:
+    # Plain-HTTP stand-in for binance.Client.get_aggregate_trades that decodes
+    # the raw body straight into a structured array; point base_url at a
+    # local server that mimics /aggTrades to test fetch paths
+    def __init__(self, base_url=BASE_URL):
+        self.base_url = base_url
+
+    def get_aggregate_trades(self, **params):
+        response = requests.get(f"{self.base_url}/aggTrades", params=params)
+        instrument.count_request(len(response.content))
+        response.raise_for_status()
+        return decode_agg_trades(response.content)
+
+class RequestBudget:
+    # Sliding one-minute request-weight budget shared by all fetch threads
+    def __init__(self, weight_per_minute=1200):
+        self.weight_per_minute = weight_per_minute
+        self.spent = deque()
+        self.lock = threading.Lock()
+
+    def acquire(self, weight=1):
+        if weight > self.weight_per_minute:
+            raise ValueError(f"Request weight {weight} exceeds the budget of {self.weight_per_minute} per minute")
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                while self.spent and now - self.spent[0][0] >= 60:
+                    self.spent.popleft()
+                if sum(w for _, w in self.spent) + weight <= self.weight_per_minute:
+                    self.spent.append((now, weight))
+                    return
+                wait = 60 - (now - self.spent[0][0])
+            time.sleep(wait)
+
+_budget = None
+_budget_lock = threading.Lock()
+
+def default_budget():
+    # The process-wide budget every fetch draws on unless handed its own, so
+    # separate calls in one process never each get a fresh allowance
+    global _budget
+    with _budget_lock:
+        if _budget is None:
+            _budget = RequestBudget()
+        return _budget
+
+def set_default_budget(weight_per_minute):
+    # Also a ProcessPoolExecutor initializer: one budget per worker process
+    global _budget
+    with _budget_lock:
+        _budget = RequestBudget(weight_per_minute)
+
+def fetch_trade_pages(symbol, start_time, end_time, client=None, budget=None):
+    # Yields each page as it arrives; endTime is inclusive, as in the API
+    client = client or get_client()
+    budget = budget or default_budget()
+    params = {'startTime': start_time, 'endTime': end_time}
+    while True:
+        budget.acquire(AGG_TRADES_WEIGHT)
+        response = client.get_aggregate_trades(symbol=symbol, limit=AGG_TRADES_LIMIT, **params)
+        if not isinstance(client, RestClient):
+            # RestClient counts its own requests along with their byte size
+            instrument.count_request()
+        page = store.agg_trades_to_array(response)
+        # Pages after the first are id-bounded only, so cut them at end_time
+        trades = page[page['T'] <= end_time]
+        if len(trades):
+            yield trades
+        if len(page) < AGG_TRADES_LIMIT or len(trades) < len(page):
             break
-        trades.extend(new_trades)
-        start_time = max(int(trade['T']) for trade in new_trades) + 1
-    return trades
+        # Continue from the next aggTrade id: a full page can end partway
+        # through a millisecond holding more trades than fit on one page
+        params = {'fromId': int(page['a'][-1]) + 1}
+
+def fetch_trades(symbol, start_time, end_time, client=None, budget=None):
+    pages = list(fetch_trade_pages(symbol, start_time, end_time, client, budget))
+    return np.concatenate(pages) if pages else np.empty(0, dtype=store.AGG_TRADE_DTYPE)
+
+def fetch_trades_sharded(symbol, start_time, end_time, shard_ms=SHARD_MS, max_workers=8, budget=None, client=None):
+    client = client or get_client()
+    budget = budget or default_budget()
+    shards = [(s, min(s + shard_ms, end_time)) for s in range(start_time, end_time, shard_ms)]
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        results = list(pool.map(lambda shard: fetch_trades(symbol, shard[0], shard[1], client, budget), shards))
+    if not results:
+        return np.empty(0, dtype=store.AGG_TRADE_DTYPE)
+    trades = np.concatenate(results)
+    # endTime is inclusive, so a trade sitting on a shard boundary comes back
+    # from both neighbours; shards are in order and ids increase within each,
+    # so keep a trade only if its id is above every id before it
+    seen = np.maximum.accumulate(trades['a'])
+    keep = np.ones(len(trades), dtype=bool)
+    keep[1:] = trades['a'][1:] > seen[:-1]
+    return trades[keep]
+
+def load_trades(symbol, start_time, end_time, max_workers=8, client=None, budget=None):
+    # Store-first: only ranges missing from the local store go to the API
+    def fetch(start, end):
+        if max_workers > 1:
+            return fetch_trades_sharded(symbol, start, end, max_workers=max_workers, budget=budget, client=client)
+        return fetch_trades(symbol, start, end, client=client, budget=budget)
+    return store.load(symbol, 'aggTrades', start_time, end_time, fetch)
+
+def trades_to_arrays(trades):
+    # Columnar view of aggTrades: T (int64 ms), p/q (float64), m (bool).
+    # Accepts the raw list of dicts or anything already indexable by field.
+    if isinstance(trades, list):
+        n = len(trades)
+        return {
+            'T': np.fromiter((t['T'] for t in trades), dtype=np.int64, count=n),
+            'p': np.fromiter((t['p'] for t in trades), dtype=np.float64, count=n),
+            'q': np.fromiter((t['q'] for t in trades), dtype=np.float64, count=n),
+            'm': np.fromiter((t['m'] for t in trades), dtype=bool, count=n),
+        }
+    return {
+        'T': np.asarray(trades['T'], dtype=np.int64),
+        'p': np.asarray(trades['p'], dtype=np.float64),
+        'q': np.asarray(trades['q'], dtype=np.float64),
+        'm': np.asarray(trades['m'], dtype=bool),
+    }
 
 def calculate_cvd(trades):
-    cvd = 0
-    cvd_data = []
-    for trade in trades:
-        volume = float(trade['q'])
-        price = float(trade['p'])
-        if trade['m']:  # If true, the buyer is the market maker
-            cvd -= volume
-        else:
-            cvd += volume
-        cvd_data.append({
-            'timestamp': pd.to_datetime(trade['T'], unit='ms'),
-            'cvd': cvd,
-            'price': price
-        })
-    return pd.DataFrame(cvd_data)
-
-def process_symbol(symbol, start_time, end_time):
+    cols = trades_to_arrays(trades)
+    # Buyer is the market maker -> aggressive sell -> negative delta
+    signed_volume = np.where(cols['m'], -cols['q'], cols['q'])
+    return pd.DataFrame({
+        'timestamp': pd.to_datetime(cols['T'], unit='ms'),
+        'cvd': np.cumsum(signed_volume),
+        'price': cols['p']
+    })
+
+def process_symbol(symbol, start_time, end_time, max_workers=8, budget=None):
     print(f"Processing {symbol}...")
-    trades = fetch_trades(symbol, start_time, end_time)
-    df = calculate_cvd(trades)
-    df['symbol'] = symbol
+    with instrument.stage('fetch', symbol) as stage:
+        trades = load_trades(symbol, start_time, end_time, max_workers=max_workers, budget=budget)
+        stage.rows = len(trades)
+    with instrument.stage('compute', symbol) as stage:
+        df = calculate_cvd(trades)
+        df['symbol'] = symbol
+        stage.rows = len(df)
     return df
 
-def plot_cvd_and_price(df, symbol, output_dir):
+def plot_cvd_and_price(df, symbol, output_dir, method='minmax'):
     fig, (ax1, ax2) = plt.subplots(2, 1, figsize=(12, 10), sharex=True)
+    # A day of trades is millions of points for ~1000 pixel columns; draw only what is visible
+    df = plotting.decimate_frame(df, 'timestamp', ['price', 'cvd'], plotting.pixel_width(fig, ax1), method)
  
     ax1.plot(df['timestamp'], df['price'], color='blue')
     ax1.set_title(f'Price and CVD for {symbol}')
@@ -65,17 +197,51 @@ def plot_cvd_and_price(df, symbol, output_dir):
     plt.savefig(os.path.join(output_dir, f'{symbol}_price_cvd_plot.png'))
     plt.close()
 
-def main(symbols, duration_hours=24, output_dir='output'):
+def plot_symbols(df, output_dir, max_processes=None):
+    """
+    Render the price/CVD chart of every symbol in a combined frame in parallel
+
+    Frames are decimated before being sent to the render processes.
+    """
+    width = 12 * plt.rcParams['figure.dpi']
+    jobs = [(plot_cvd_and_price, (plotting.decimate_frame(group, 'timestamp', ['price', 'cvd'], width), symbol, output_dir), {})
+            for symbol, group in df.groupby('symbol', sort=False)]
+    plotting.render_many(jobs, max_processes)
+
+def run_symbol(symbol, start_time, end_time, output_dir):
+    # fetch -> compute -> plot for one symbol, run inside a worker process; every
+    # symbol the worker runs shares its budget, set up by the pool initializer
+    df = process_symbol(symbol, start_time, end_time, budget=default_budget())
+    with instrument.stage('plot', symbol) as stage:
+        plot_cvd_and_price(df, symbol, output_dir)
+        stage.rows = len(df)
+    return df
+
+def main(symbols, duration_hours=24, output_dir='output', max_processes=None, weight_per_minute=1200):
     end_time = int(datetime.now().timestamp() * 1000)
     start_time = int((datetime.now() - timedelta(hours=duration_hours)).timestamp() * 1000)
-    
-    all_data = pd.DataFrame()
-    for symbol in symbols:
-        symbol_data = process_symbol(symbol, start_time, end_time)
-        all_data = pd.concat([all_data, symbol_data], ignore_index=True)
-        plot_cvd_and_price(symbol_data, symbol, output_dir)
-    
-    return all_data
+
+    if not symbols:
+        return pd.DataFrame()
+    max_processes = max_processes or min(len(symbols), os.cpu_count() or 1)
+    # Every process gets an equal slice of the API weight budget, but at
+    # least one request's worth so a slice can never refuse every request
+    process_weight = max(weight_per_minute // max_processes, AGG_TRADES_WEIGHT)
+
+    results = {}
+    with ProcessPoolExecutor(max_workers=max_processes, initializer=set_default_budget,
+                             initargs=(process_weight,)) as pool:
+        futures = {pool.submit(run_symbol, symbol, start_time, end_time, output_dir): symbol
+                   for symbol in symbols}
+        for future in as_completed(futures):
+            symbol = futures[future]
+            try:
+                results[symbol] = future.result()
+            except Exception as e:
+                print(f"Failed to process {symbol}: {e}")
+
+    frames = [results[symbol] for symbol in symbols if symbol in results]
+    return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
 
 if __name__ == "__main__":
     symbols = ['BTCUSDT', 'ETHUSDT', 'BNBUSDT']  
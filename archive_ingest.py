@@ -0,0 +1,215 @@
+import os
+import re
+import glob
+import zipfile
+import hashlib
+import argparse
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+import numpy as np
+import store
+import chunked
+import instrument
+from decode import KLINE_DTYPE, AGG_TRADE_DTYPE, TRADE_DTYPE, decode_csv
+
+# Uncompressed CSV bytes parsed at a time
+CHUNK_BYTES = 64 * 2**20
+
+# <SYMBOL>-aggTrades-2024-01-01.zip, <SYMBOL>-trades-2024-01.zip, <SYMBOL>-1m-2024-01-01.zip
+_ARCHIVE_NAME = re.compile(r'^([A-Z0-9]+)-(aggTrades|trades|\d+[smhdw])-(\d{4}-\d{2}(?:-\d{2})?)\.zip$')
+
+# Spot dumps switched these columns from milliseconds to microseconds in 2025
+_TIME_FIELDS = {'aggTrades': ('T',), 'trades': ('time',)}
+_KLINE_TIME_FIELDS = ('timestamp', 'close_time')
+# Milliseconds stay below this until the year 5138; microseconds are already above it
+_MICROSECONDS = 10 ** 14
+
+
+def parse_name(path):
+    """
+    :return: (symbol, dataset, date) of an archive file name; dataset is
+        'aggTrades', 'trades' or a kline interval, date is YYYY-MM-DD or YYYY-MM
+    """
+    match = _ARCHIVE_NAME.match(os.path.basename(path))
+    if match is None:
+        raise ValueError(f"Not a Binance public data archive: {path}")
+    return match.groups()
+
+
+def archive_range(date):
+    # [start, end) in ms of a daily (YYYY-MM-DD) or monthly (YYYY-MM) archive
+    if len(date) == 10:
+        start = datetime.strptime(date, '%Y-%m-%d').replace(tzinfo=timezone.utc)
+        return int(start.timestamp() * 1000), int(start.timestamp() * 1000) + store.DAY_MS
+    start = datetime.strptime(date, '%Y-%m').replace(tzinfo=timezone.utc)
+    end = start.replace(year=start.year + start.month // 12, month=start.month % 12 + 1)
+    return int(start.timestamp() * 1000), int(end.timestamp() * 1000)
+
+
+def _dtype(dataset):
+    return {'aggTrades': AGG_TRADE_DTYPE, 'trades': TRADE_DTYPE}.get(dataset, KLINE_DTYPE)
+
+
+def verify_checksum(path):
+    """
+    Check a zip against the SHA256 in its .CHECKSUM file ('<hex digest>  <file name>')
+    """
+    checksum_path = path + '.CHECKSUM'
+    if not os.path.exists(checksum_path):
+        raise ValueError(f"No checksum file for {path}")
+    with open(checksum_path) as f:
+        expected = f.read().split()[0].lower()
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(2**20), b''):
+            digest.update(block)
+    if digest.hexdigest() != expected:
+        raise ValueError(f"Checksum mismatch for {path}")
+
+
+def read_archive(path, chunk_bytes=CHUNK_BYTES):
+    """
+    Rows of an archive as typed arrays, decompressed and parsed chunk by chunk
+
+    :return: Generator of structured arrays in the store's layout, times in ms
+    """
+    _, dataset, _ = parse_name(path)
+    dtype = _dtype(dataset)
+    time_fields = _TIME_FIELDS.get(dataset, _KLINE_TIME_FIELDS)
+    with zipfile.ZipFile(path) as archive:
+        for member in archive.namelist():
+            with archive.open(member) as f:
+                rest = b''
+                while True:
+                    block = f.read(chunk_bytes)
+                    if not block:
+                        break
+                    # Parse whole lines only; the partial last line waits for the next block
+                    block = rest + block
+                    cut = block.rfind(b'\n') + 1
+                    rest = block[cut:]
+                    if cut:
+                        yield _to_ms(decode_csv(block[:cut], dtype), time_fields)
+                if rest.strip():
+                    yield _to_ms(decode_csv(rest, dtype), time_fields)
+
+
+def _to_ms(rows, time_fields):
+    for name in time_fields:
+        if len(rows) and rows[name][0] >= _MICROSECONDS:
+            rows[name] //= 1000
+    return rows
+
+
+def _ingest_group(paths, root=None, verify=True, chunk_bytes=CHUNK_BYTES):
+    # One worker's share: every archive of one symbol, dataset and month, so no
+    # two workers ever write the same day partition. Coverage is left to the
+    # parent, which marks it once every archive has gone in.
+    ingested = []
+    for path in paths:
+        symbol, dataset, date = parse_name(path)
+        start, end = archive_range(date)
+        with instrument.stage('ingest', symbol) as stage:
+            if verify:
+                verify_checksum(path)
+            for rows in read_archive(path, chunk_bytes):
+                store.write(symbol, dataset, rows, start, end, root, complete_until=start)
+                stage.rows += len(rows)
+            stage.bytes = os.path.getsize(path)
+        ingested.append((symbol, dataset, start, end))
+    return ingested
+
+
+def find_archives(directory, symbols=None, datasets=None):
+    paths = []
+    for path in sorted(glob.glob(os.path.join(directory, '**', '*.zip'), recursive=True)):
+        try:
+            symbol, dataset, _ = parse_name(path)
+        except ValueError:
+            continue
+        if (symbols is None or symbol in symbols) and (datasets is None or dataset in datasets):
+            paths.append(path)
+    return paths
+
+
+def ingest(paths, root=None, verify=True, max_processes=None, chunk_bytes=CHUNK_BYTES):
+    """
+    Load archives into the local store on a process pool
+
+    :return: Number of archives ingested
+    """
+    groups = defaultdict(list)
+    for path in paths:
+        symbol, dataset, date = parse_name(path)
+        groups[(symbol, dataset, date[:7])].append(path)
+    with ProcessPoolExecutor(max_workers=max_processes) as pool:
+        results = [pool.submit(_ingest_group, sorted(group, key=lambda p: parse_name(p)[2]), root, verify, chunk_bytes)
+                   for group in groups.values()]
+        ingested = [item for result in results for item in result.result()]
+    for symbol, dataset, start, end in ingested:
+        # An empty write just records [start, end) as stored
+        store.write(symbol, dataset, np.empty(0, dtype=_dtype(dataset)), start, end, root)
+    return len(ingested)
+
+
+def trade_chunks(paths, chunk_size=chunked.CHUNK_SIZE, verify=True):
+    """
+    aggTrades of one symbol's archives in time order, in chunks for chunked.process_chunks
+    """
+    def rows():
+        last_id = -1
+        for path in sorted(paths, key=lambda p: parse_name(p)[2]):
+            if verify:
+                verify_checksum(path)
+            for page in read_archive(path):
+                # A monthly and a daily archive may cover the same trades
+                page = page[page['a'] > last_id]
+                if len(page):
+                    last_id = int(page['a'][-1])
+                    yield page
+    return chunked.rechunk(rows(), chunk_size)
+
+
+def _run_engines(symbol, paths, interval, tick_size, chunk_size, verify):
+    # write_chunks replaces the parts of every date it writes, so re-ingesting
+    # the same or a later batch of archives never leaves stale chunks behind
+    chunked.write_chunks(symbol, trade_chunks(paths, chunk_size, verify), interval, tick_size)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load Binance public-data archives (data.binance.vision) without the API")
+    parser.add_argument('directory', help="Directory searched recursively for .zip archives and their .CHECKSUM files")
+    parser.add_argument('--symbols', nargs='+')
+    parser.add_argument('--datasets', nargs='+', help="aggTrades, trades and/or kline intervals such as 1m")
+    parser.add_argument('--processes', type=int)
+    parser.add_argument('--no-verify', action='store_true', help="Skip the SHA256 checksum check")
+    parser.add_argument('--engines', action='store_true',
+                        help="Also stream aggTrades archives through the chunked CVD/footprint/TPS pipeline")
+    parser.add_argument('--interval', default='1m', help="Footprint bar interval for --engines")
+    parser.add_argument('--tick-size', type=float, default=10)
+    parser.add_argument('--chunk-size', type=int, default=chunked.CHUNK_SIZE)
+    args = parser.parse_args()
+
+    paths = find_archives(args.directory, args.symbols, args.datasets)
+    count = ingest(paths, verify=not args.no_verify, max_processes=args.processes)
+    print(f"Ingested {count} archives into {store.STORE_DIR}")
+
+    if args.engines:
+        by_symbol = defaultdict(list)
+        for path in paths:
+            symbol, dataset, _ = parse_name(path)
+            if dataset == 'aggTrades':
+                by_symbol[symbol].append(path)
+        with ProcessPoolExecutor(max_workers=args.processes) as pool:
+            # Checksums were already checked on the way into the store
+            for future in [pool.submit(_run_engines, symbol, symbol_paths, args.interval, args.tick_size,
+                                       args.chunk_size, False)
+                           for symbol, symbol_paths in by_symbol.items()]:
+                future.result()
+        print(f"cvd_chunked, footprint_trades_chunked and metrics_chunked for {len(by_symbol)} symbols "
+              f"written under output/")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+import time
+import numpy as np
+import pandas as pd
+import store
+from decode import KLINE_DTYPE
+
+# Every other interval is rolled up from this one series, so a symbol is
+# downloaded once no matter how many intervals the indicators ask for
+BASE_INTERVAL = '1m'
+
+_FIRST = ('open',)
+_LAST = ('close', 'close_time')
+_HIGH = ('high',)
+_LOW = ('low',)
+_KEEP = ('ignore',)
+
+
+def _buckets(timestamps, interval):
+    # Start index and open time of each `interval` bar in a sorted run of base bars
+    opens = store.bar_open_time(timestamps, interval)
+    starts = np.flatnonzero(np.r_[True, opens[1:] != opens[:-1]]) if len(opens) else np.empty(0, dtype=np.int64)
+    return starts, opens[starts]
+
+
+def _reduce(name, values, starts):
+    if name in _FIRST:
+        return values[starts]
+    if name in _LAST:
+        return values[np.r_[starts[1:], len(values)] - 1]
+    if name in _HIGH:
+        return np.maximum.reduceat(values, starts)
+    if name in _LOW:
+        return np.minimum.reduceat(values, starts)
+    if name in _KEEP:
+        return values[starts]
+    # Volumes, quote volumes and trade counts add up
+    return np.add.reduceat(values, starts)
+
+
+def aggregate(bars, interval):
+    """
+    Roll base bars up into `interval` bars
+
+    :param bars: KLINE_DTYPE array sorted by open time
+    :return: KLINE_DTYPE array with one row per `interval` bar that has base bars
+    """
+    starts, opens = _buckets(bars['timestamp'], interval)
+    out = np.empty(len(starts), dtype=KLINE_DTYPE)
+    if not len(starts):
+        return out
+    for name in KLINE_DTYPE.names:
+        out[name] = _reduce(name, bars[name], starts)
+    out['timestamp'] = opens
+    out['close_time'] = opens + store.interval_ms(interval) - 1
+    return out
+
+
+def aggregate_frame(df, interval):
+    """
+    Same roll-up for a frame with a datetime `timestamp` column, e.g. from process_klines_data
+    """
+    timestamps = df['timestamp'].to_numpy().astype('datetime64[ms]').astype(np.int64)
+    starts, opens = _buckets(timestamps, interval)
+    out = {'timestamp': pd.to_datetime(opens, unit='ms')}
+    for name in df.columns:
+        if name != 'timestamp':
+            out[name] = _reduce(name, df[name].to_numpy(), starts) if len(starts) else df[name].to_numpy()[:0]
+    return pd.DataFrame(out, columns=df.columns)
+
+
+def _check_interval(interval):
+    step = store.interval_ms(interval)
+    base = store.interval_ms(BASE_INTERVAL)
+    if step < base or step % base:
+        raise ValueError(f"{interval} bars cannot be built from {BASE_INTERVAL} bars")
+    return step
+
+
+def history(symbol, interval, start_time, end_time, root=None):
+    """
+    Closed `interval` bars opening in [start_time, end_time)
+
+    The base series is fetched into the store once; derived intervals are
+    aggregated from it and stored too, so repeated requests are plain reads.
+    Windows are not capped at the API's 1000 bars.
+
+    :return: KLINE_DTYPE array
+    """
+    if interval == BASE_INTERVAL:
+        return store.load(symbol, interval, start_time, end_time,
+                          lambda s, e: store.fetch_klines(symbol, interval, s, e), root)
+    step = _check_interval(interval)
+
+    def derive(start, end):
+        start = store.bar_open_time(start, interval)
+        end = store.bar_open_time(end - 1, interval) + step
+        return aggregate(history(symbol, BASE_INTERVAL, start, end, root), interval)
+
+    return store.load(symbol, interval, start_time, end_time, derive, root)
+
+
+def get_bars(symbol, interval, limit, root=None):
+    """
+    Latest `limit` bars of any interval, the last one still open
+
+    Closed bars come from history(), and the open bar is rebuilt from the
+    stored base bars plus the live base bar.
+
+    :return: Structured array with the kline column names as fields
+    """
+    step = _check_interval(interval)
+    now = int(time.time() * 1000)
+    open_time = store.bar_open_time(now, interval)
+    closed = history(symbol, interval, open_time - (limit - 1) * step, open_time, root)
+    base_open = store.bar_open_time(now, BASE_INTERVAL)
+    live = np.concatenate([
+        history(symbol, BASE_INTERVAL, open_time, base_open, root),
+        store.fetch_klines(symbol, BASE_INTERVAL, base_open, base_open + store.interval_ms(BASE_INTERVAL))
+    ])
+    return np.concatenate([closed, aggregate(live, interval)])
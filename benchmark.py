@@ -0,0 +1,159 @@
+import os
+import sys
+import json
+import time
+import argparse
+import resource
+import tracemalloc
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
+import pandas as pd
+import synthetic
+
+
+def _trades_frame(n):
+    data = synthetic.trades(n)
+    df = pd.DataFrame({name: data[name] for name in data.dtype.names})
+    df['time'] = pd.to_datetime(df['time'], unit='ms')
+    return df
+
+
+def _sessions_frame(n):
+    import session_volume_Profile
+    df = synthetic.klines_frame(n, '1m')
+    session_start = pd.to_datetime('00:00:00').time()
+    session_end = (datetime.combine(datetime.min, session_start) + timedelta(hours=8)).time()
+    return session_volume_Profile.define_sessions(df, session_start, session_end)
+
+
+def _cvd(n):
+    import CVD
+    return CVD.calculate_cvd, (synthetic.agg_trades(n),)
+
+
+def _trade_footprint(n):
+    import footprint
+    return footprint.calculate_trade_footprint, (synthetic.agg_trades(n), '1m', 10)
+
+
+def _footprint(n):
+    import footprint
+    df = synthetic.klines_frame(n, '15m')
+    return footprint.calculate_footprint_data, (df, footprint.create_price_levels(df, 10))
+
+
+def _tpo(n):
+    import market_profile
+    df = synthetic.klines_frame(n, '1m')
+    return market_profile.create_tpo_profile, (df, market_profile.create_price_levels(df, 10))
+
+
+def _volume_profile(n):
+    import volume_profile
+    return volume_profile.calculate_volume_profile, (synthetic.klines_frame(n, '1h'),)
+
+
+def _session_profile(n):
+    import session_volume_Profile
+    return session_volume_Profile.calculate_session_volume_profile, (_sessions_frame(n),)
+
+
+def _metrics(n):
+    import vps_tps
+    return vps_tps.calculate_metrics, (_trades_frame(n), '1S')
+
+
+# Each case builds its input outside the timed region and returns (fn, args)
+CASES = {
+    'calculate_cvd': _cvd,
+    'calculate_trade_footprint': _trade_footprint,
+    'calculate_footprint_data': _footprint,
+    'create_tpo_profile': _tpo,
+    'calculate_volume_profile': _volume_profile,
+    'calculate_session_volume_profile': _session_profile,
+    'calculate_metrics': _metrics,
+}
+
+
+def run_case(name, rows, repeat=3):
+    fn, args = CASES[name](rows)
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn(*args)
+        best = min(best, time.perf_counter() - start)
+    # A separate traced run so tracemalloc overhead stays out of the timings
+    tracemalloc.start()
+    fn(*args)
+    _, alloc_peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        'case': name,
+        'rows': rows,
+        'seconds': best,
+        'rows_per_sec': rows / best,
+        'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        'alloc_peak_mb': alloc_peak / 2**20
+    }
+
+
+def run(cases, sizes, repeat=3):
+    # One fresh process per (case, size) so peak RSS is that case's alone
+    context = multiprocessing.get_context('spawn')
+    results = []
+    for name in cases:
+        for rows in sizes:
+            with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+                result = pool.submit(run_case, name, rows, repeat).result()
+            print(f"{name:34s} {rows:>12,d} rows {result['seconds']:10.4f}s "
+                  f"{result['rows_per_sec']:16,.0f} rows/s {result['peak_rss_mb']:9.1f} MB RSS "
+                  f"{result['alloc_peak_mb']:9.1f} MB alloc")
+            results.append(result)
+    return results
+
+
+def compare(results, baseline, tolerance):
+    # A case regresses when its throughput drops more than `tolerance` below the baseline
+    reference = {(r['case'], r['rows']): r for r in baseline}
+    regressions = []
+    for result in results:
+        base = reference.get((result['case'], result['rows']))
+        if base is None:
+            continue
+        ratio = result['rows_per_sec'] / base['rows_per_sec']
+        if ratio < 1 - tolerance:
+            regressions.append(result)
+            print(f"REGRESSION {result['case']} @ {result['rows']:,d} rows: "
+                  f"{ratio:.2f}x of baseline throughput")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline indicator benchmarks on synthetic data")
+    parser.add_argument('--cases', nargs='+', default=list(CASES), choices=list(CASES))
+    parser.add_argument('--sizes', nargs='+', default=['1e3', '1e4', '1e5', '1e6'],
+                        help="Row counts to sweep, e.g. 1e3 1e5 1e8")
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--save', help="Write results to this baseline JSON file")
+    parser.add_argument('--baseline', help="Compare against a saved baseline JSON file")
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help="Allowed throughput drop before a case counts as a regression")
+    args = parser.parse_args()
+
+    results = run(args.cases, [int(float(size)) for size in args.sizes], args.repeat)
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"Results saved to {args.save}")
+
+    if args.baseline and os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,191 @@
+import os
+import glob
+import argparse
+from datetime import datetime, timedelta
+import numpy as np
+import pandas as pd
+import instrument
+from CVD import RequestBudget, load_trades, trades_to_arrays
+from footprint import TradeFootprint
+from columnar import write_table
+
+# Trades are fetched into the store and read back one window at a time
+WINDOW_MS = 3600 * 1000
+CHUNK_SIZE = 1_000_000
+
+
+def trade_windows(symbol, start_time, end_time, window_ms=WINDOW_MS, max_workers=8, budget=None):
+    """
+    aggTrades of [start_time, end_time) one store-backed window at a time
+
+    :param budget: RequestBudget every window's fetches draw on, so the whole
+        backfill stays under one request-weight limit
+    """
+    for window_start in range(start_time, end_time, window_ms):
+        with instrument.stage('fetch', symbol) as stage:
+            trades = load_trades(symbol, window_start, min(window_start + window_ms, end_time),
+                                 max_workers=max_workers, budget=budget)
+            stage.rows = len(trades)
+        yield trades
+
+
+def rechunk(arrays, chunk_size=CHUNK_SIZE):
+    """
+    Regroup a stream of structured arrays into chunks of `chunk_size` rows; the last may be shorter
+    """
+    pending = []
+    count = 0
+    for array in arrays:
+        while len(array):
+            part = array[:chunk_size - count]
+            array = array[len(part):]
+            pending.append(part)
+            count += len(part)
+            if count == chunk_size:
+                yield np.concatenate(pending)
+                pending = []
+                count = 0
+    if count:
+        yield np.concatenate(pending)
+
+
+class ChunkedCVD:
+    # Cumulative delta carried from one chunk to the next
+    def __init__(self):
+        self.total = 0.0
+
+    def add(self, trades):
+        cols = trades_to_arrays(trades)
+        # Buyer is the market maker -> aggressive sell -> negative delta
+        signed_volume = np.where(cols['m'], -cols['q'], cols['q'])
+        # Seeding the cumsum with the running total keeps the same summation
+        # order as one cumsum over the whole history
+        cvd = np.cumsum(np.r_[self.total, signed_volume])[1:]
+        if len(cvd):
+            self.total = cvd[-1]
+        return pd.DataFrame({
+            'timestamp': pd.to_datetime(cols['T'], unit='ms'),
+            'cvd': cvd,
+            'price': cols['p']
+        })
+
+
+class ChunkedMetrics:
+    # Per-second TPS/VPS; the newest second may continue in the next chunk, so it is held back
+    def __init__(self):
+        self.second = None
+        self.tps = 0
+        self.vps = 0.0
+
+    def _frame(self, first_second, tps, vps):
+        index = pd.to_datetime((first_second + np.arange(len(tps))) * 1000, unit='ms')
+        return pd.DataFrame({'tps': tps, 'vps': vps}, index=pd.DatetimeIndex(index, name='time'))
+
+    def add(self, trades):
+        cols = trades_to_arrays(trades)
+        if len(cols['T']) == 0:
+            return self._frame(0, np.empty(0, dtype=np.int64), np.empty(0))
+        seconds = cols['T'] // 1000
+        first = self.second if self.second is not None else int(seconds[0])
+        offset = seconds - first
+        n = int(offset[-1]) + 1
+        # Every second in between gets a row, including empty ones, like a resample
+        tps = np.bincount(offset, minlength=n)
+        vps = np.bincount(offset, weights=cols['q'], minlength=n)
+        tps[0] += self.tps
+        vps[0] += self.vps
+        self.second, self.tps, self.vps = first + n - 1, tps[-1], vps[-1]
+        return self._frame(first, tps[:-1], vps[:-1])
+
+    def flush(self):
+        if self.second is None:
+            return self._frame(0, np.empty(0, dtype=np.int64), np.empty(0))
+        return self._frame(self.second, np.array([self.tps]), np.array([self.vps]))
+
+
+def process_chunks(chunks, interval='1m', tick_size=10, imbalance_ratio=3.0, symbol=None):
+    """
+    CVD, trade footprint and TPS/VPS over a stream of aggTrade chunks
+
+    Running state (cumulative delta, the open footprint bar, the open second)
+    carries across chunks, so memory is bounded by the chunk size, not the
+    length of the history.
+
+    :param chunks: Iterable of aggTrade arrays in time order
+    :return: Generator of dicts with the 'cvd', 'footprint' and 'metrics'
+        rows finished by each chunk; a last dict flushes the open bar and second
+    """
+    cvd = ChunkedCVD()
+    footprint = TradeFootprint(interval, tick_size)
+    metrics = ChunkedMetrics()
+    for chunk in chunks:
+        with instrument.stage('compute', symbol) as stage:
+            footprint.add(chunk)
+            output = {
+                'cvd': cvd.add(chunk),
+                'footprint': footprint.flush(imbalance_ratio),
+                'metrics': metrics.add(chunk)
+            }
+            stage.rows = len(chunk)
+        yield output
+    yield {'cvd': None, 'footprint': footprint.to_frame(imbalance_ratio), 'metrics': metrics.flush()}
+
+
+def _drop_stale_parts(paths, cleared):
+    # The first write of a run into a partition removes the part files an earlier run left there
+    for path in paths:
+        directory = os.path.dirname(path)
+        if directory not in cleared:
+            cleared.add(directory)
+            for stale in glob.glob(os.path.join(directory, 'data-*')):
+                if stale != path:
+                    os.remove(stale)
+
+
+def write_chunks(symbol, chunks, interval='1m', tick_size=10):
+    """
+    Run process_chunks and write each chunk's output as its own part file inside the date partitions
+
+    Datasets get a _chunked suffix so they never mix with the single-file
+    outputs of footprint.py and vps_tps.py; a rerun replaces the parts of
+    every partition it writes to.
+    """
+    datasets = (('cvd', 'cvd_chunked', 'timestamp'), ('footprint', 'footprint_trades_chunked', 'timestamp'),
+                ('metrics', 'metrics_chunked', 'time'))
+    cleared = set()
+    for part, output in enumerate(process_chunks(chunks, interval, tick_size, symbol=symbol)):
+        with instrument.stage('write', symbol) as stage:
+            for key, dataset, time_column in datasets:
+                frame = output[key]
+                if frame is not None and len(frame):
+                    paths = write_table(frame, dataset, symbol, time_column=time_column, part=part)
+                    _drop_stale_parts(paths, cleared)
+                    stage.rows += len(frame)
+
+
+def run(symbol, start_time, end_time, interval='1m', tick_size=10, chunk_size=CHUNK_SIZE,
+        window_ms=WINDOW_MS, max_workers=8, weight_per_minute=1200):
+    budget = RequestBudget(weight_per_minute)
+    chunks = rechunk(trade_windows(symbol, start_time, end_time, window_ms, max_workers, budget), chunk_size)
+    write_chunks(symbol, chunks, interval, tick_size)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Out-of-core CVD, footprint and TPS/VPS over long aggTrade histories")
+    parser.add_argument('symbol')
+    parser.add_argument('--days', type=float, default=30)
+    parser.add_argument('--interval', default='1m', help="Footprint bar interval")
+    parser.add_argument('--tick-size', type=float, default=10)
+    parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE, help="Trades per chunk")
+    parser.add_argument('--weight-per-minute', type=int, default=1200,
+                        help="API request weight the whole backfill may spend per minute")
+    args = parser.parse_args()
+
+    end_time = int(datetime.now().timestamp() * 1000)
+    start_time = int((datetime.now() - timedelta(days=args.days)).timestamp() * 1000)
+    run(args.symbol, start_time, end_time, args.interval, args.tick_size, args.chunk_size,
+        weight_per_minute=args.weight_per_minute)
+
+
+if __name__ == "__main__":
+    main()
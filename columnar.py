@@ -0,0 +1,117 @@
+import os
+import glob
+import warnings
+import numpy as np
+import pandas as pd
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    import pyarrow.ipc as ipc
+except ImportError:
+    pa = None
+
+OUTPUT_DIR = 'output'
+# 'parquet' (zstd), 'ipc' (Arrow IPC, memory-mappable) or 'csv'
+OUTPUT_FORMAT = os.environ.get('TICKLAB_OUTPUT_FORMAT', 'parquet')
+_EXTENSIONS = {'parquet': 'parquet', 'ipc': 'arrow', 'csv': 'csv'}
+
+
+def _is_array_column(column):
+    return column.dtype == object and len(column) and isinstance(column.iloc[0], (np.ndarray, list))
+
+
+def _to_arrow(df):
+    array_columns = [name for name in df.columns if _is_array_column(df[name])]
+    table = pa.Table.from_pandas(df.drop(columns=array_columns), preserve_index=False)
+    for name in array_columns:
+        # Equal-length arrays become one fixed-size list column backed by a
+        # single flat buffer, so they read back as a 2D array without parsing
+        values = np.stack(df[name].to_numpy())
+        table = table.append_column(name, pa.FixedSizeListArray.from_arrays(pa.array(values.ravel()), values.shape[1]))
+    return table
+
+
+def _partitions(df, symbol, time_column):
+    if time_column is None:
+        yield symbol, pd.Timestamp.now(tz='UTC').strftime('%Y-%m-%d'), df
+        return
+    dates = pd.to_datetime(df[time_column]).dt.strftime('%Y-%m-%d')
+    for date, part in df.groupby(dates.to_numpy(), sort=True):
+        yield symbol, date, part
+
+
+def write_table(df, dataset, symbol, time_column=None, root=None, format=None, part=None):
+    """
+    Write a frame as <root>/<dataset>/symbol=<symbol>/date=<YYYY-MM-DD>/data[-<part>].<ext>
+
+    Columns holding equal-length arrays (e.g. session volume profiles) are
+    stored as native fixed-size list columns.
+
+    :param time_column: Column the date partitions are taken from; today's date if None
+    :param format: 'parquet', 'ipc' or 'csv'; defaults to TICKLAB_OUTPUT_FORMAT
+    :param part: Write data-<part> files instead of data, so several writes can share a partition
+    :return: Paths written
+    """
+    format = format or OUTPUT_FORMAT
+    if format != 'csv' and pa is None:
+        warnings.warn("pyarrow is not installed; writing CSV instead of " + format)
+        format = 'csv'
+    df = df.reset_index(drop=not df.index.name)
+    paths = []
+    filename = 'data' if part is None else f"data-{part:05d}"
+    for symbol, date, rows in _partitions(df, symbol, time_column):
+        directory = os.path.join(root or OUTPUT_DIR, dataset, f"symbol={symbol}", f"date={date}")
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f"{filename}.{_EXTENSIONS[format]}")
+        # A partition holds one copy of its data: drop it in any other format an earlier run used
+        for extension in _EXTENSIONS.values():
+            other = os.path.join(directory, f"{filename}.{extension}")
+            if other != path and os.path.exists(other):
+                os.remove(other)
+        if format == 'csv':
+            rows = rows.copy()
+            for name in rows.columns:
+                if _is_array_column(rows[name]):
+                    rows[name] = [list(values) for values in rows[name]]
+            rows.to_csv(path, index=False)
+        elif format == 'parquet':
+            pq.write_table(_to_arrow(rows), path, compression='zstd')
+        elif format == 'ipc':
+            table = _to_arrow(rows)
+            with ipc.new_file(path, table.schema) as writer:
+                writer.write_table(table)
+        else:
+            raise ValueError(f"Unknown output format: {format}")
+        paths.append(path)
+    return paths
+
+
+def read_table(dataset, symbol='*', date='*', root=None):
+    """
+    Read a dataset written by write_table back as one Arrow table
+
+    IPC files are memory-mapped, so their columns reference the file
+    directly instead of being copied into memory.
+    """
+    pattern = os.path.join(root or OUTPUT_DIR, dataset, f"symbol={symbol}", f"date={date}", "data*")
+    tables = []
+    skipped = 0
+    for path in sorted(glob.glob(pattern)):
+        if path.endswith('.parquet'):
+            tables.append(pq.read_table(path))
+        elif path.endswith('.arrow'):
+            tables.append(ipc.open_file(pa.memory_map(path)).read_all())
+        else:
+            skipped += 1
+    if skipped:
+        warnings.warn(f"read_table skipped {skipped} CSV files in {dataset}; only parquet and ipc output is read back")
+    return pa.concat_tables(tables) if tables else None
+
+
+def array_column(table, name):
+    """
+    A fixed-size list column as a 2D NumPy view over the Arrow buffer
+    """
+    column = table.column(name).combine_chunks()
+    return column.values.to_numpy(zero_copy_only=True).reshape(len(column), column.type.list_size)
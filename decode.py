@@ -0,0 +1,193 @@
+import json
+import time
+import numpy as np
+import pandas as pd
+
+KLINE_DTYPE = np.dtype([
+    ('timestamp', 'i8'), ('open', 'f8'), ('high', 'f8'), ('low', 'f8'), ('close', 'f8'),
+    ('volume', 'f8'), ('close_time', 'i8'), ('quote_asset_volume', 'f8'),
+    ('number_of_trades', 'i8'), ('taker_buy_base_asset_volume', 'f8'),
+    ('taker_buy_quote_asset_volume', 'f8'), ('ignore', 'f8')
+])
+
+# /api/v3/aggTrades objects, fields in payload order
+AGG_TRADE_DTYPE = np.dtype([
+    ('a', 'i8'), ('p', 'f8'), ('q', 'f8'), ('f', 'i8'), ('l', 'i8'), ('T', 'i8'), ('m', '?'), ('M', '?')
+])
+
+# /api/v3/trades objects, fields in payload order
+TRADE_DTYPE = np.dtype([
+    ('id', 'i8'), ('price', 'f8'), ('qty', 'f8'), ('quoteQty', 'f8'), ('time', 'i8'),
+    ('isBuyerMaker', '?'), ('isBestMatch', '?')
+])
+
+
+def _check_error(payload):
+    if payload.lstrip()[:1] == b'{':
+        error = json.loads(payload)
+        raise ValueError(f"API error {error.get('code')}: {error.get('msg')}")
+
+
+# Keys, quotes and brackets: everything in these payloads that is not a number
+_STRIP = b'[]{}":\n\r\t ' + bytes(range(ord('a'), ord('z') + 1)) + bytes(range(ord('A'), ord('Z') + 1))
+
+
+_NUMBER_CHARS = b'0123456789.,+-eE'
+
+
+def _decode(payload, dtype):
+    # Every value in these payloads is an integer, a plain decimal string or
+    # a bool, so once bools become 1/0 and all letters and punctuation are
+    # deleted in one translate() pass, what is left is a flat comma-separated
+    # list of numbers that np.fromstring parses in C
+    text = payload.replace(b'true', b'1').replace(b'false', b'0').translate(None, _STRIP)
+    if not text:
+        return np.empty(0, dtype=dtype)
+    values = _parse_numbers(text)
+    if values is None or len(values) % len(dtype.names):
+        return None
+    return _to_structured(values, dtype)
+
+
+def _parse_numbers(text):
+    # np.fromstring stops at the first value it cannot parse and, depending
+    # on the NumPy version, warns and returns what it has or raises. Text
+    # with anything but number characters or with empty fields goes straight
+    # to the caller's fallback, and a short or failed parse is None as well.
+    if text.translate(None, _NUMBER_CHARS) or b',,' in text or text[:1] == b',' or text[-1:] == b',':
+        return None
+    try:
+        values = np.fromstring(text, sep=',')
+    except (ValueError, DeprecationWarning):
+        return None
+    if len(values) != text.count(b',') + 1:
+        return None
+    return values
+
+
+def _to_structured(values, dtype):
+    values = values.reshape(-1, len(dtype.names))
+    out = np.empty(len(values), dtype=dtype)
+    for i, name in enumerate(dtype.names):
+        out[name] = values[:, i]
+    return out
+
+
+def decode_csv(payload, dtype):
+    """
+    Parse CSV rows whose columns are in `dtype` field order, e.g. the
+    Binance public data dumps, into a structured array
+
+    A header line is skipped; True/False become 1/0 as in the JSON payloads.
+    """
+    if payload[:1].isalpha():
+        payload = payload[payload.find(b'\n') + 1:]
+    text = (payload.replace(b'True', b'1').replace(b'False', b'0')
+            .replace(b'true', b'1').replace(b'false', b'0')
+            .replace(b'\r', b'').replace(b'\n', b',').strip(b','))
+    if not text:
+        return np.empty(0, dtype=dtype)
+    values = _parse_numbers(text)
+    if values is None or len(values) % len(dtype.names):
+        raise ValueError(f"Malformed CSV: expected {len(dtype.names)} numeric columns per row")
+    return _to_structured(values, dtype)
+
+
+def _first_keys(payload):
+    start = payload.find(b'{')
+    if start < 0:
+        return None
+    return tuple(json.loads(payload[start:payload.index(b'}', start) + 1]))
+
+
+def _decode_objects(payload, dtype):
+    _check_error(payload)
+    keys = _first_keys(payload)
+    out = None
+    if keys is None or keys == dtype.names:
+        out = _decode(payload, dtype)
+    if out is None:
+        # Unexpected layout: take the slow but general route
+        records = json.loads(payload)
+        out = np.empty(len(records), dtype=dtype)
+        for name in dtype.names:
+            out[name] = np.array([r[name] for r in records], dtype=dtype[name])
+    return out
+
+
+def decode_klines(payload):
+    """
+    Parse a raw /klines response body into a KLINE_DTYPE structured array
+    """
+    _check_error(payload)
+    out = _decode(payload, KLINE_DTYPE)
+    if out is None:
+        klines = json.loads(payload)
+        out = np.empty(len(klines), dtype=KLINE_DTYPE)
+        for name, column in zip(KLINE_DTYPE.names, zip(*klines)):
+            out[name] = np.array(column, dtype=KLINE_DTYPE[name])
+    return out
+
+
+def decode_agg_trades(payload):
+    """
+    Parse a raw /aggTrades response body into an AGG_TRADE_DTYPE structured array
+    """
+    return _decode_objects(payload, AGG_TRADE_DTYPE)
+
+
+def decode_trades(payload):
+    """
+    Parse a raw /trades response body into a TRADE_DTYPE structured array
+    """
+    return _decode_objects(payload, TRADE_DTYPE)
+
+
+def _sample_klines(n, seed=0):
+    rng = np.random.default_rng(seed)
+    close = 60000 + np.cumsum(rng.normal(0, 30, n))
+    return json.dumps([
+        [1700000000000 + i * 60000, f"{c:.2f}", f"{c + 20:.2f}", f"{c - 20:.2f}", f"{c:.2f}", f"{v:.5f}",
+         1700000000000 + i * 60000 + 59999, f"{v * c:.4f}", 100, f"{v / 2:.5f}", f"{v * c / 2:.4f}", "0"]
+        for i, (c, v) in enumerate(zip(close, rng.exponential(100, n)))
+    ], separators=(',', ':')).encode()
+
+
+def _sample_agg_trades(n, seed=0):
+    rng = np.random.default_rng(seed)
+    price = 60000 + np.cumsum(rng.normal(0, 0.5, n))
+    return json.dumps([
+        {"a": i, "p": f"{p:.2f}", "q": f"{q:.5f}", "f": i, "l": i, "T": 1700000000000 + i, "m": bool(m), "M": True}
+        for i, (p, q, m) in enumerate(zip(price, rng.exponential(0.05, n), rng.random(n) < 0.5))
+    ], separators=(',', ':')).encode()
+
+
+def benchmark(n=200_000, repeat=3):
+    """
+    Rows/sec of json + DataFrame + astype(float) against the direct decoders
+    """
+    columns = list(KLINE_DTYPE.names)
+    float_columns = ['open', 'high', 'low', 'close', 'volume', 'taker_buy_base_asset_volume']
+    cases = [
+        ('klines', _sample_klines(n),
+         lambda payload: pd.DataFrame(json.loads(payload), columns=columns)[float_columns].astype(float),
+         decode_klines),
+        ('aggTrades', _sample_agg_trades(n),
+         lambda payload: pd.DataFrame(json.loads(payload))[['p', 'q']].astype(float),
+         decode_agg_trades),
+    ]
+    for name, payload, baseline, decoder in cases:
+        timings = {}
+        for label, fn in (('json+pandas', baseline), ('decode', decoder)):
+            best = float('inf')
+            for _ in range(repeat):
+                start = time.perf_counter()
+                fn(payload)
+                best = min(best, time.perf_counter() - start)
+            timings[label] = best
+            print(f"{name:10s} {label:12s} {n / best:14,.0f} rows/sec")
+        print(f"{name:10s} speedup      {timings['json+pandas'] / timings['decode']:.1f}x")
+
+
+if __name__ == "__main__":
+    benchmark()
@@ -1,18 +1,11 @@
-import requests
 import pandas as pd
 import numpy as np
-
-BASE_URL = "https://api.binance.com/api/v3"
-
-def get_klines(symbol, interval, limit):
-    endpoint = f"{BASE_URL}/klines"
-    params = {
-        "symbol": symbol,
-        "interval": interval,
-        "limit": limit
-    }
-    response = requests.get(endpoint, params=params)
-    return response.json()
+import store
+import instrument
+from columnar import write_table
+from price_grid import PriceGrid
+from bars import get_bars
+from CVD import load_trades, trades_to_arrays
 
 def process_klines_data(klines):
     df = pd.DataFrame(klines, columns=['timestamp', 'open', 'high', 'low', 'close', 'volume', 
@@ -25,54 +18,195 @@ def process_klines_data(klines):
     return df
 
 def create_price_levels(df, tick_size):
-    price_low = df['low'].min()
-    price_high = df['high'].max()
-    price_levels = np.arange(price_low, price_high + tick_size, tick_size)
-    return price_levels
+    # Lower edges of the tick levels the window traded in, anchored at multiples of the tick
+    return PriceGrid(tick_size).price_levels(df['low'].min(), df['high'].max())
+
+class FootprintMatrix:
+    # Candle x price-level volumes in CSR form: candle i covers the levels
+    # indices[indptr[i]:indptr[i + 1]] with the matching buy/sell volumes
+    def __init__(self, timestamps, price_levels, indptr, indices, buy_volume, sell_volume):
+        self.timestamps = timestamps
+        self.price_levels = price_levels
+        self.indptr = indptr
+        self.indices = indices
+        self.buy_volume = buy_volume
+        self.sell_volume = sell_volume
+
+    @property
+    def shape(self):
+        return len(self.indptr) - 1, len(self.price_levels)
+
+    def rows(self):
+        return np.repeat(np.arange(self.shape[0]), np.diff(self.indptr))
+
+    def to_dense(self):
+        buy = np.zeros(self.shape)
+        sell = np.zeros(self.shape)
+        rows = self.rows()
+        buy[rows, self.indices] = self.buy_volume
+        sell[rows, self.indices] = self.sell_volume
+        return buy, sell
+
+    def to_frame(self):
+        return pd.DataFrame({
+            'timestamp': np.asarray(self.timestamps)[self.rows()],
+            'price': self.price_levels[self.indices],
+            'buy_volume': self.buy_volume,
+            'sell_volume': self.sell_volume
+        })
+
+def build_footprint_matrix(df, price_levels):
+    # Every tick level from the one holding the low to the one holding the high
+    first = np.maximum(np.searchsorted(price_levels, df['low'].to_numpy(), side='right') - 1, 0)
+    last = np.searchsorted(price_levels, df['high'].to_numpy(), side='right')
+    level_count = np.maximum(last - first, 0)
+
+    indptr = np.zeros(len(df) + 1, dtype=np.int64)
+    np.cumsum(level_count, out=indptr[1:])
+    rows = np.repeat(np.arange(len(df)), level_count)
+    indices = np.arange(indptr[-1]) - indptr[rows] + first[rows]
+
+    # Candle volume is spread evenly over the levels it traded through
+    share = np.divide(1.0, level_count, out=np.zeros(len(df)), where=level_count > 0)
+    buy_volume = (df['taker_buy_base_asset_volume'].to_numpy() * share)[rows]
+    sell_volume = (df['taker_sell_base_asset_volume'].to_numpy() * share)[rows]
+    return FootprintMatrix(df['timestamp'].to_numpy(), price_levels, indptr, indices, buy_volume, sell_volume)
 
 def calculate_footprint_data(df, price_levels):
-    footprint_data = []
-    
-    for _, candle in df.iterrows():
-        candle_low = candle['low']
-        candle_high = candle['high']
-        candle_buy_volume = candle['taker_buy_base_asset_volume']
-        candle_sell_volume = candle['taker_sell_base_asset_volume']
-        
-
-        level_count = sum((price_levels >= candle_low) & (price_levels <= candle_high))
-        if level_count > 0:
-            buy_volume_per_level = candle_buy_volume / level_count
-            sell_volume_per_level = candle_sell_volume / level_count
-            
-            for price in price_levels[(price_levels >= candle_low) & (price_levels <= candle_high)]:
-                footprint_data.append({
-                    'timestamp': candle['timestamp'],
-                    'price': price,
-                    'buy_volume': buy_volume_per_level,
-                    'sell_volume': sell_volume_per_level
-                })
-    
-    return pd.DataFrame(footprint_data)
+    return build_footprint_matrix(df, price_levels).to_frame()
+
+def _sum_cells(bars, levels, bid_volume, ask_volume):
+    # Collapse duplicate (bar, level) cells, sorted by bar then level
+    if len(bars) == 0:
+        return bars, levels, bid_volume, ask_volume
+    bar0, level0 = bars.min(), levels.min()
+    span = levels.max() - level0 + 1
+    keys, inverse = np.unique((bars - bar0) * span + (levels - level0), return_inverse=True)
+    return (keys // span + bar0, keys % span + level0,
+            np.bincount(inverse, weights=bid_volume, minlength=len(keys)),
+            np.bincount(inverse, weights=ask_volume, minlength=len(keys)))
+
+class TradeFootprint:
+    # Footprint binned from actual aggTrades into (bar, tick level) cells.
+    # Feed trades in time order, chunk by chunk: bars older than the newest
+    # chunk are final and are not touched again, so memory stays at one
+    # chunk plus the output cells.
+    def __init__(self, interval, tick_size):
+        self.interval = interval
+        self.interval_ms = store.interval_ms(interval)
+        self.tick_size = tick_size
+        self.grid = PriceGrid(tick_size)
+        self._parts = []
+        empty = np.empty(0, dtype=np.int64)
+        self._tail = (empty, empty, np.empty(0), np.empty(0))
+
+    def add(self, trades):
+        cols = trades_to_arrays(trades)
+        if len(cols['T']) == 0:
+            return
+        bars = cols['T'] // self.interval_ms
+        levels = self.grid.level(cols['p'])
+        # Buyer is the maker -> the aggressor sold into the bid
+        bid_volume = np.where(cols['m'], cols['q'], 0.0)
+        ask_volume = np.where(cols['m'], 0.0, cols['q'])
+
+        cut = np.searchsorted(self._tail[0], bars.min())
+        self._parts.append(tuple(column[:cut] for column in self._tail))
+        self._tail = _sum_cells(*(np.concatenate([column[cut:], new]) for column, new
+                                  in zip(self._tail, (bars, levels, bid_volume, ask_volume))))
+
+    def cells(self):
+        return tuple(np.concatenate(columns) for columns in zip(*self._parts, self._tail))
+
+    def to_frame(self, imbalance_ratio=3.0):
+        return self._frame(self.cells(), imbalance_ratio)
+
+    def flush(self, imbalance_ratio=3.0):
+        """
+        Frame of the bars closed so far, which are then dropped from memory
+
+        Trades arrive in time order, so every bar before the newest one is
+        closed; the newest stays behind to be completed by the next chunk.
+        """
+        cut = np.searchsorted(self._tail[0], self._tail[0][-1]) if len(self._tail[0]) else 0
+        closed = tuple(np.concatenate(columns) for columns in
+                       zip(*self._parts, tuple(column[:cut] for column in self._tail)))
+        self._parts = []
+        self._tail = tuple(column[cut:] for column in self._tail)
+        return self._frame(closed, imbalance_ratio)
+
+    def _frame(self, cells, imbalance_ratio):
+        bars, levels, bid_volume, ask_volume = cells
+        # Diagonal imbalance: ask volume against the bid one tick lower, bid
+        # volume against the ask one tick higher, within the same bar
+        adjacent = (bars[1:] == bars[:-1]) & (levels[1:] == levels[:-1] + 1)
+        bid_below = np.zeros(len(bars))
+        bid_below[1:][adjacent] = bid_volume[:-1][adjacent]
+        ask_above = np.zeros(len(bars))
+        ask_above[:-1][adjacent] = ask_volume[1:][adjacent]
+        return pd.DataFrame({
+            'timestamp': pd.to_datetime(bars * self.interval_ms, unit='ms'),
+            'price': self.grid.price(levels),
+            'bid_volume': bid_volume,
+            'ask_volume': ask_volume,
+            'delta': ask_volume - bid_volume,
+            'buy_imbalance': (ask_volume > 0) & (ask_volume >= imbalance_ratio * bid_below),
+            'sell_imbalance': (bid_volume > 0) & (bid_volume >= imbalance_ratio * ask_above)
+        })
+
+def calculate_trade_footprint(trades, interval, tick_size, chunk_size=5_000_000, imbalance_ratio=3.0):
+    cols = trades_to_arrays(trades)
+    footprint = TradeFootprint(interval, tick_size)
+    for start in range(0, len(cols['T']), chunk_size):
+        footprint.add({name: column[start:start + chunk_size] for name, column in cols.items()})
+    return footprint.to_frame(imbalance_ratio)
 
 def main():
     symbol = 'BTCUSDT'
     interval = '15m'  
     limit = 100  
     tick_size = 10  
+    source = 'klines'  # 'trades' bins the actual aggTrades instead of spreading candle volume
+
+    if source == 'trades':
+        end_time = int(pd.Timestamp.now(tz='UTC').timestamp() * 1000)
+        start_time = end_time - limit * store.interval_ms(interval)
+        with instrument.stage('fetch', symbol) as stage:
+            trades = load_trades(symbol, start_time, end_time)
+            stage.rows = len(trades)
+        with instrument.stage('compute', symbol) as stage:
+            footprint_df = calculate_trade_footprint(trades, interval, tick_size)
+            stage.rows = len(footprint_df)
+        print(footprint_df.head())
+        print(f"\nShape of footprint DataFrame: {footprint_df.shape}")
+        with instrument.stage('write', symbol) as stage:
+            paths = write_table(footprint_df, 'footprint_trades', symbol, time_column='timestamp')
+            stage.rows = len(footprint_df)
+        print(f"Footprint data saved to {len(paths)} partitions under output/footprint_trades")
+        return
 
-    klines = get_klines(symbol, interval, limit)
-    df = process_klines_data(klines)
+    with instrument.stage('fetch', symbol) as stage:
+        klines = get_bars(symbol, interval, limit)
+        stage.rows = len(klines)
+    with instrument.stage('parse', symbol) as stage:
+        df = process_klines_data(klines)
+        stage.rows = len(df)
     
-    price_levels = create_price_levels(df, tick_size)
-    footprint_df = calculate_footprint_data(df, price_levels)
+    with instrument.stage('compute', symbol) as stage:
+        price_levels = create_price_levels(df, tick_size)
+        footprint = build_footprint_matrix(df, price_levels)
+        footprint_df = footprint.to_frame()
+        stage.rows = len(df)
     
     print(footprint_df.head())
-    print(f"\nShape of footprint DataFrame: {footprint_df.shape}")
+    print(f"\nFootprint matrix: {footprint.shape[0]} candles x {footprint.shape[1]} price levels")
+    print(f"Shape of footprint DataFrame: {footprint_df.shape}")
     
 
-    footprint_df.to_csv("output/footprint_data.csv", index=False)
-    print("Footprint data saved to footprint_data.csv")
+    with instrument.stage('write', symbol) as stage:
+        paths = write_table(footprint_df, 'footprint', symbol, time_column='timestamp')
+        stage.rows = len(footprint_df)
+    print(f"Footprint data saved to {len(paths)} partitions under output/footprint")
 
 
 
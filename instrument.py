@@ -0,0 +1,170 @@
+import os
+import sys
+import json
+import time
+import atexit
+import cProfile
+import resource
+import threading
+import tracemalloc
+import multiprocessing
+from contextlib import contextmanager
+
+# JSON lines file every finished stage is appended to; appends are one line
+# each, so worker processes can share the file
+METRICS_PATH = os.environ.get('TICKLAB_METRICS')
+# Prometheus textfile written from the collected stages when the run exits
+PROMETHEUS_PATH = os.environ.get('TICKLAB_METRICS_PROM')
+# 'cprofile' dumps a .pstats file per stage, 'tracemalloc' records allocation peaks and top sites
+PROFILE_MODE = os.environ.get('TICKLAB_PROFILE', '')
+PROFILE_DIR = os.environ.get('TICKLAB_PROFILE_DIR', os.path.join('output', 'profiles'))
+
+SCRIPT = os.path.splitext(os.path.basename(sys.argv[0] or 'python'))[0]
+
+STARTED = time.time()
+
+records = []
+_active = []
+_lock = threading.Lock()
+
+if PROFILE_MODE == 'tracemalloc':
+    tracemalloc.start()
+
+
+class Stage:
+    def __init__(self, name, symbol=None):
+        self.name = name
+        self.symbol = symbol
+        self.rows = 0
+        self.bytes = 0
+        self.requests = 0
+
+
+def count_request(nbytes=0):
+    # Charged to every open stage, so a fetch nested in a larger stage counts for both
+    with _lock:
+        for stage in _active:
+            stage.requests += 1
+            stage.bytes += nbytes
+
+
+def _max_rss():
+    # ru_maxrss is in KB on Linux: the process high-water mark so far
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+@contextmanager
+def stage(name, symbol=None):
+    """
+    Time a pipeline stage and record its rows, bytes, requests and memory
+
+    Memory is the growth of the process RSS high-water mark over the stage,
+    plus the process-wide peak; TICKLAB_PROFILE=tracemalloc adds the
+    stage's own allocation peak.
+
+    :param name: Stage name, e.g. 'fetch', 'parse', 'compute', 'write' or 'plot'
+    :param symbol: Symbol the stage works on, if any
+    """
+    current = Stage(name, symbol)
+    with _lock:
+        _active.append(current)
+    profiler = None
+    if PROFILE_MODE == 'cprofile':
+        profiler = cProfile.Profile()
+        profiler.enable()
+    if PROFILE_MODE == 'tracemalloc':
+        tracemalloc.reset_peak()
+    rss_before = _max_rss()
+    start = time.perf_counter()
+    try:
+        yield current
+    finally:
+        seconds = time.perf_counter() - start
+        with _lock:
+            _active.remove(current)
+        record = {
+            'time': time.time(),
+            'pid': os.getpid(),
+            'script': SCRIPT,
+            'stage': name,
+            'symbol': symbol,
+            'seconds': seconds,
+            'rows': int(current.rows),
+            'bytes': int(current.bytes),
+            'requests': current.requests,
+            # How far this stage pushed the process's RSS high-water mark; 0 if
+            # it stayed below a peak an earlier stage had already set
+            'rss_growth_bytes': _max_rss() - rss_before,
+            'process_peak_rss_bytes': _max_rss()
+        }
+        if profiler is not None:
+            profiler.disable()
+            os.makedirs(PROFILE_DIR, exist_ok=True)
+            path = os.path.join(PROFILE_DIR, f"{SCRIPT}_{symbol or 'all'}_{name}_{os.getpid()}.pstats")
+            profiler.dump_stats(path)
+            record['profile'] = path
+        if PROFILE_MODE == 'tracemalloc':
+            record['alloc_peak_bytes'] = tracemalloc.get_traced_memory()[1]
+            top = tracemalloc.take_snapshot().statistics('lineno')[:10]
+            record['top_allocations'] = [f"{stat.traceback}: {stat.size} B" for stat in top]
+        _record(record)
+
+
+def _record(record):
+    with _lock:
+        records.append(record)
+        if METRICS_PATH:
+            with open(METRICS_PATH, 'a') as f:
+                f.write(json.dumps(record) + '\n')
+
+
+def load_jsonl(path):
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def export_jsonl(path, stage_records=None):
+    with open(path, 'w') as f:
+        for record in records if stage_records is None else stage_records:
+            f.write(json.dumps(record) + '\n')
+
+
+def export_prometheus(path, stage_records=None):
+    """
+    Write stage totals in the Prometheus textfile-collector format
+    """
+    totals = {}
+    for record in records if stage_records is None else stage_records:
+        key = (record['script'], record['stage'], record['symbol'] or '')
+        total = totals.setdefault(key, {'seconds': 0.0, 'rows': 0, 'bytes': 0, 'requests': 0,
+                                        'runs': 0, 'rss_growth_bytes': 0, 'process_peak_rss_bytes': 0})
+        for field in ('seconds', 'rows', 'bytes', 'requests'):
+            total[field] += record[field]
+        total['runs'] += 1
+        for field in ('rss_growth_bytes', 'process_peak_rss_bytes'):
+            total[field] = max(total[field], record.get(field, 0))
+
+    lines = []
+    for field, kind in (('seconds', 'counter'), ('rows', 'counter'), ('bytes', 'counter'),
+                        ('requests', 'counter'), ('runs', 'counter'), ('rss_growth_bytes', 'gauge'),
+                        ('process_peak_rss_bytes', 'gauge')):
+        metric = f"ticklab_stage_{field}" + ('_total' if kind == 'counter' else '')
+        lines.append(f"# TYPE {metric} {kind}")
+        for (script, name, symbol), total in sorted(totals.items()):
+            lines.append(f'{metric}{{script="{script}",stage="{name}",symbol="{symbol}"}} {total[field]}')
+    # Textfile collectors read whole files, so swap the file in atomically
+    with open(path + '.tmp', 'w') as f:
+        f.write('\n'.join(lines) + '\n')
+    os.replace(path + '.tmp', path)
+
+
+def _export_at_exit():
+    if PROMETHEUS_PATH and multiprocessing.parent_process() is None:
+        stage_records = records
+        if METRICS_PATH and os.path.exists(METRICS_PATH):
+            # The JSON lines file also holds this run's worker-process stages
+            stage_records = [r for r in load_jsonl(METRICS_PATH) if r['time'] >= STARTED]
+        export_prometheus(PROMETHEUS_PATH, stage_records)
+
+
+atexit.register(_export_at_exit)
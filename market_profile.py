@@ -1,20 +1,11 @@
-import requests
 import pandas as pd
 import numpy as np
+from bars import get_bars, aggregate_frame
+import instrument
+from columnar import write_table
+from price_grid import PriceGrid
 from datetime import datetime, timedelta
 
-BASE_URL = "https://api.binance.com/api/v3"
-
-def get_klines(symbol, interval, limit):
-    endpoint = f"{BASE_URL}/klines"
-    params = {
-        "symbol": symbol,
-        "interval": interval,
-        "limit": limit
-    }
-    response = requests.get(endpoint, params=params)
-    return response.json()
-
 def process_klines_data(klines):
     df = pd.DataFrame(klines, columns=['timestamp', 'open', 'high', 'low', 'close', 'volume', 
                                        'close_time', 'quote_asset_volume', 'number_of_trades', 
@@ -25,41 +16,76 @@ def process_klines_data(klines):
     return df
 
 def create_price_levels(df, tick_size):
-    price_low = df['low'].min()
-    price_high = df['high'].max()
-    price_levels = np.arange(price_low, price_high + tick_size, tick_size)
-    return price_levels
-
-def create_tpo_profile(df, price_levels, tpo_period='30T'):
-    df_resampled = df.resample(tpo_period, on='timestamp').agg({
-        'high': 'max',
-        'low': 'min',
-        'close': 'last'
-    })
-
-    tpo_profile = pd.DataFrame(index=price_levels, columns=df_resampled.index)
-
-    for timestamp, row in df_resampled.iterrows():
-        tpo_profile.loc[row['low']:row['high'], timestamp] = timestamp.strftime('%A')[:1]
-
-    return tpo_profile
+    # Lower edges of the tick levels the window traded in, anchored at multiples of the tick
+    return PriceGrid(tick_size).price_levels(df['low'].min(), df['high'].max())
+
+class TPOProfile:
+    # TPO presence kept as one [first, last) price-level index range per
+    # period; counts and letters are derived from the ranges on demand
+    def __init__(self, price_levels, periods, first, last):
+        self.price_levels = price_levels
+        self.periods = periods
+        self.first = first
+        self.last = last
+
+    def period_letters(self):
+        return np.array([ts.strftime('%A')[:1] for ts in self.periods], dtype='U1')
+
+    def counts(self):
+        # Difference array: +1 where a period's range opens, -1 past its end
+        n = len(self.price_levels)
+        diff = np.bincount(self.first, minlength=n + 1) - np.bincount(self.last, minlength=n + 1)
+        return np.cumsum(diff[:-1])
+
+    def matrix(self):
+        levels = np.arange(len(self.price_levels))[:, None]
+        return ((levels >= self.first) & (levels < self.last)).astype(np.uint8)
+
+    def letters(self):
+        codes = np.frombuffer(''.join(self.period_letters()).encode(), dtype=np.uint8)
+        return [codes[row.astype(bool)].tobytes().decode() for row in self.matrix()]
+
+    def to_frame(self):
+        letters = np.where(self.matrix().astype(bool), self.period_letters(), None)
+        return pd.DataFrame(letters, index=self.price_levels, columns=self.periods)
+
+    def to_ranges(self):
+        filled = self.last > self.first
+        return pd.DataFrame({
+            'period': self.periods[filled],
+            'letter': self.period_letters()[filled],
+            'low': self.price_levels[self.first[filled]],
+            'high': self.price_levels[self.last[filled] - 1]
+        })
+
+def create_tpo_profile(df, price_levels, tpo_period='30m'):
+    df_resampled = aggregate_frame(df[['timestamp', 'high', 'low', 'close']], tpo_period).set_index('timestamp')
+
+    # Tick levels from the one holding the low to the one holding the high, for all periods at once
+    low = df_resampled['low'].to_numpy()
+    high = df_resampled['high'].to_numpy()
+    traded = ~(np.isnan(low) | np.isnan(high))
+    first = np.where(traded, np.maximum(np.searchsorted(price_levels, np.nan_to_num(low), side='right') - 1, 0), 0)
+    last = np.where(traded, np.searchsorted(price_levels, np.nan_to_num(high), side='right'), 0)
+    last = np.maximum(first, last)
+
+    return TPOProfile(price_levels, df_resampled.index, first, last)
 
 def calculate_value_area(tpo_profile, value_area_percentage=0.7):
-    total_tpos = tpo_profile.notna().sum().sum()
-    target_tpos = int(total_tpos * value_area_percentage)
-
-    tpo_counts = tpo_profile.notna().sum(axis=1).sort_values(ascending=False)
-    cumulative_tpos = tpo_counts.cumsum()
+    counts = tpo_profile.counts()
+    target_tpos = int(counts.sum() * value_area_percentage)
 
-    value_area_prices = cumulative_tpos[cumulative_tpos <= target_tpos].index
+    order = np.argsort(-counts, kind='stable')
+    cumulative_tpos = np.cumsum(counts[order])
+    value_area_prices = tpo_profile.price_levels[order[cumulative_tpos <= target_tpos]]
 
-    value_area_high = value_area_prices.max()
-    value_area_low = value_area_prices.min()
-    poc = tpo_counts.index[0]
+    value_area_high = value_area_prices.max() if len(value_area_prices) else np.nan
+    value_area_low = value_area_prices.min() if len(value_area_prices) else np.nan
+    poc = tpo_profile.price_levels[order[0]]
 
     return poc, value_area_low, value_area_high
 
-def create_market_profile(df, tick_size, tpo_period='30T'):
+def create_market_profile(df, tick_size, tpo_period='30m', include_letters=True):
     price_levels = create_price_levels(df, tick_size)
     tpo_profile = create_tpo_profile(df, price_levels, tpo_period)
     poc, va_low, va_high = calculate_value_area(tpo_profile)
@@ -67,12 +93,13 @@ def create_market_profile(df, tick_size, tpo_period='30T'):
 
     summary = pd.DataFrame({
         'price_level': price_levels,
-        'tpo_count': tpo_profile.notna().sum(axis=1),
+        'tpo_count': tpo_profile.counts(),
         'is_poc': price_levels == poc,
         'in_value_area': (price_levels >= va_low) & (price_levels <= va_high)
     })
 
-    summary['tpo_letters'] = tpo_profile.apply(lambda row: ''.join(row.dropna().values), axis=1)
+    if include_letters:
+        summary['tpo_letters'] = tpo_profile.letters()
 
     return summary, tpo_profile, poc, va_low, va_high
 
@@ -82,10 +109,16 @@ def main():
     limit = 1000  
     tick_size = 10  
 
-    klines = get_klines(symbol, interval, limit)
-    df = process_klines_data(klines)
+    with instrument.stage('fetch', symbol) as stage:
+        klines = get_bars(symbol, interval, limit)
+        stage.rows = len(klines)
+    with instrument.stage('parse', symbol) as stage:
+        df = process_klines_data(klines)
+        stage.rows = len(df)
 
-    market_profile_summary, tpo_profile, poc, va_low, va_high = create_market_profile(df, tick_size)
+    with instrument.stage('compute', symbol) as stage:
+        market_profile_summary, tpo_profile, poc, va_low, va_high = create_market_profile(df, tick_size)
+        stage.rows = len(df)
 
     print("Market Profile Summary:")
     print(market_profile_summary)
@@ -95,9 +128,11 @@ def main():
     print(f"Value Area High: {va_high}")
 
 
-    market_profile_summary.to_csv("market_profile_summary.csv", index=False)
-    tpo_profile.to_csv("output/tpo_profile.csv")
-    print("Market Profile data saved to CSV files")
+    with instrument.stage('write', symbol) as stage:
+        write_table(market_profile_summary, 'market_profile_summary', symbol)
+        write_table(tpo_profile.to_ranges(), 'tpo_profile', symbol, time_column='period')
+        stage.rows = len(market_profile_summary)
+    print("Market Profile data saved under output/market_profile_summary and output/tpo_profile")
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,123 @@
+import os
+import matplotlib
+# Charts are only ever written to files, so never start a GUI backend
+matplotlib.use('Agg')
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+
+def _as_numbers(x):
+    x = np.asarray(x)
+    if np.issubdtype(x.dtype, np.datetime64):
+        return x.view(np.int64)
+    return x.astype(float)
+
+
+def minmax_decimate(x, y, width):
+    """
+    Indices of the min and max point in each of `width` pixel columns
+
+    Extremes survive, so spikes stay visible; x must be sorted.
+    """
+    n = len(x)
+    if n <= 2 * width:
+        return np.arange(n)
+    xs = _as_numbers(x)
+    y = np.asarray(y, dtype=float)
+    # Offsets in float: nanosecond timestamps times the width overflow int64 past ~100 days
+    offset = (xs - xs[0]).astype(float)
+    span = offset[-1] or 1.0
+    column = np.minimum(np.floor(offset / span * width).astype(np.int64), width - 1)
+    starts = np.flatnonzero(np.r_[True, column[1:] != column[:-1]])
+    counts = np.diff(np.r_[starts, n])
+    lows = np.repeat(np.minimum.reduceat(y, starts), counts)
+    highs = np.repeat(np.maximum.reduceat(y, starts), counts)
+    # First position in each column that hits its min, and its max
+    first_low = np.flatnonzero(y == lows)
+    first_low = first_low[np.unique(column[first_low], return_index=True)[1]]
+    first_high = np.flatnonzero(y == highs)
+    first_high = first_high[np.unique(column[first_high], return_index=True)[1]]
+    return np.unique(np.concatenate([first_low, first_high, [0, n - 1]]))
+
+
+def lttb(x, y, threshold):
+    """
+    Indices picked by Largest-Triangle-Three-Buckets downsampling to `threshold` points
+    """
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+    xs = _as_numbers(x)
+    xs = xs - xs[0]
+    y = np.asarray(y, dtype=float)
+    edges = np.linspace(1, n - 1, threshold - 1).astype(np.int64)
+    picked = np.empty(threshold, dtype=np.int64)
+    picked[0], picked[-1] = 0, n - 1
+    a = 0
+    for i in range(threshold - 2):
+        lo, hi = edges[i], edges[i + 1]
+        next_hi = edges[i + 2] if i + 2 < len(edges) else n
+        # Average of the next bucket is the third vertex of the triangle
+        avg_x = xs[hi:next_hi].mean()
+        avg_y = y[hi:next_hi].mean()
+        area = np.abs((xs[a] - avg_x) * (y[lo:hi] - y[a]) - (xs[a] - xs[lo:hi]) * (avg_y - y[a]))
+        a = lo + int(np.argmax(area))
+        picked[i + 1] = a
+    return picked
+
+
+def decimate(x, y, width, method='minmax'):
+    """
+    Downsample a series to a pixel budget before handing it to matplotlib
+
+    :param width: Plot width in pixels
+    :param method: 'minmax' keeps each pixel column's extremes, 'lttb' keeps the visual shape
+    :return: Decimated (x, y) as NumPy arrays
+    """
+    x = np.asarray(x)
+    y = np.asarray(y)
+    idx = _indices(x, y, width, method)
+    return x[idx], y[idx]
+
+
+def decimate_frame(df, x, columns, width, method='minmax'):
+    """
+    Rows of `df` needed to draw each of `columns` against `x` at `width` pixels
+
+    Takes the union over the columns, so they stay aligned on the same x.
+    """
+    xs = df[x].to_numpy()
+    idx = np.unique(np.concatenate([_indices(xs, df[column].to_numpy(), width, method) for column in columns]))
+    return df.iloc[idx]
+
+
+def _indices(x, y, width, method):
+    if method == 'minmax':
+        return minmax_decimate(x, y, width)
+    if method == 'lttb':
+        return lttb(x, y, 2 * width)
+    raise ValueError(f"Unknown decimation method: {method}")
+
+
+def pixel_width(fig, ax):
+    # Width of one axes in device pixels, the budget to decimate to
+    return max(int(ax.get_position().width * fig.get_figwidth() * fig.dpi), 1)
+
+
+def _render(job):
+    fn, args, kwargs = job
+    return fn(*args, **kwargs)
+
+
+def render_many(jobs, max_processes=None):
+    """
+    Render charts in worker processes
+
+    :param jobs: Iterable of (plot function, args, kwargs); everything must be picklable,
+        so decimate large frames first to keep what is sent to the workers small
+    :return: Whatever each plot function returned, in job order
+    """
+    jobs = list(jobs)
+    if not jobs:
+        return []
+    with ProcessPoolExecutor(max_workers=max_processes or min(len(jobs), os.cpu_count() or 1)) as pool:
+        return list(pool.map(_render, jobs))
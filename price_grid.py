@@ -0,0 +1,48 @@
+import numpy as np
+
+# Binance quotes prices with at most 8 decimals, so prices in these units are exact integers
+PRICE_SCALE = 10 ** 8
+
+
+class PriceGrid:
+    """
+    Integer price levels anchored at multiples of the tick size
+
+    Level k covers [k * tick_size, (k + 1) * tick_size). Prices are binned in
+    integer arithmetic, so a price on a level boundary always lands on that
+    level, and levels from different windows, sessions or runs line up and
+    can be added together directly.
+    """
+    def __init__(self, tick_size):
+        self.tick_size = tick_size
+        self.tick_units = int(round(tick_size * PRICE_SCALE))
+        if self.tick_units <= 0:
+            raise ValueError(f"Tick size too small: {tick_size}")
+
+    def level(self, prices):
+        """
+        Level of each price, as int64
+        """
+        units = np.rint(np.asarray(prices, dtype=float) * PRICE_SCALE).astype(np.int64)
+        return units // self.tick_units
+
+    def level_of(self, price):
+        # Scalar version of level() for per-trade code
+        return round(price * PRICE_SCALE) // self.tick_units
+
+    def price(self, levels):
+        """
+        Lower edge of each level, as the float closest to its exact decimal price
+        """
+        return np.asarray(levels, dtype=np.int64) * self.tick_units / PRICE_SCALE
+
+    def levels(self, low, high):
+        # Every level from the one holding `low` to the one holding `high`
+        return np.arange(self.level(low), self.level(high) + 1)
+
+    def price_levels(self, low, high):
+        return self.price(self.levels(low, high))
+
+    def edges(self, low, high):
+        # Level boundaries around [low, high]: one more edge than levels
+        return self.price(np.arange(self.level(low), self.level(high) + 2))
@@ -0,0 +1,171 @@
+import os
+import json
+import time
+import numpy as np
+import store
+import bars
+from value_area import poc_and_value_area
+from price_grid import PriceGrid
+
+# Bars are turned into per-level rows this many at a time while building
+CHUNK_BARS = 4096
+
+
+class ProfileIndex:
+    """
+    Cumulative volume and TPO counts per (bar, price level), memory-mapped from disk
+
+    Row k holds the totals of every bar before bar k, so the profile of any
+    window is the difference of two rows: O(levels) whatever the window length.
+    Volume is spread evenly over the levels of each bar's low-high range and
+    every bar adds one TPO to each level it touched.
+    """
+    def __init__(self, directory):
+        self.directory = directory
+        with open(os.path.join(directory, 'meta.json')) as f:
+            self.meta = json.load(f)
+        rows, levels = self.meta['rows'], self.meta['levels']
+        self.tick_size = self.meta['tick_size']
+        self.interval = self.meta['interval']
+        self.price_levels = PriceGrid(self.tick_size).price(self.meta['origin'] + np.arange(levels))
+        self.times = np.memmap(os.path.join(directory, 'times.i8'), dtype=np.int64, mode='r', shape=(rows - 1,)) \
+            if rows > 1 else np.empty(0, dtype=np.int64)
+        self.volume = np.memmap(os.path.join(directory, 'volume.f8'), dtype=np.float64, mode='r', shape=(rows, levels))
+        self.tpo = np.memmap(os.path.join(directory, 'tpo.i4'), dtype=np.int32, mode='r', shape=(rows, levels))
+
+    def window(self, start_time, end_time):
+        """
+        Volume and TPO count per price level for bars opening in [start_time, end_time)
+
+        start_time and end_time may be arrays, giving one profile per window.
+        """
+        i = np.searchsorted(self.times, start_time)
+        j = np.searchsorted(self.times, end_time)
+        return self.volume[j] - self.volume[i], self.tpo[j] - self.tpo[i]
+
+    def profile(self, start_time, end_time, value_area=0.7, by='volume', method='larger'):
+        """
+        Profile, POC and value area of one or more windows
+
+        :param by: 'volume' or 'tpo', the counts the POC and value area are taken from
+        :return: Dict of price_levels, volume, tpo, poc, value_area_low and value_area_high
+        """
+        volume, tpo = self.window(start_time, end_time)
+        poc, low, high = poc_and_value_area(volume if by == 'volume' else tpo, value_area, method)
+        return {
+            'price_levels': self.price_levels,
+            'volume': volume,
+            'tpo': tpo,
+            'poc': self.price_levels[poc],
+            'value_area_low': self.price_levels[low],
+            'value_area_high': self.price_levels[high]
+        }
+
+
+def index_dir(symbol, interval, tick_size, root=None):
+    return store.partition_dir(symbol, f"profile_index_{interval}_{tick_size:g}", root)
+
+
+def _bar_rows(data, origin, levels, tick_size):
+    # Per-bar level rows from a difference array: +w at the low level, -w past the high
+    n = len(data)
+    width = levels + 1
+    grid = PriceGrid(tick_size)
+    first = grid.level(data['low']) - origin
+    last = grid.level(data['high']) - origin + 1
+    offsets = np.arange(n) * width
+    per_level = data['volume'] / (last - first)
+    volume = np.bincount(offsets + first, per_level, n * width) - np.bincount(offsets + last, per_level, n * width)
+    tpo = np.bincount(offsets + first, minlength=n * width) - np.bincount(offsets + last, minlength=n * width)
+    volume = np.cumsum(volume.reshape(n, width), axis=1)[:, :-1]
+    tpo = np.cumsum(tpo.reshape(n, width), axis=1)[:, :-1]
+    return volume, tpo
+
+
+def _append(directory, meta, data):
+    levels = meta['levels']
+    paths = [os.path.join(directory, name) for name in ('times.i8', 'volume.f8', 'tpo.i4')]
+    # Drop whatever an interrupted append left past the last committed row
+    for path, row_bytes, rows in zip(paths, (8, 8 * levels, 4 * levels), (meta['rows'] - 1, meta['rows'], meta['rows'])):
+        with open(path, 'ab') as f:
+            f.truncate(row_bytes * rows)
+    volume_total = np.fromfile(paths[1], dtype=np.float64, count=levels, offset=8 * levels * (meta['rows'] - 1))
+    tpo_total = np.fromfile(paths[2], dtype=np.int32, count=levels, offset=4 * levels * (meta['rows'] - 1))
+    with open(paths[0], 'ab') as times, open(paths[1], 'ab') as volume, open(paths[2], 'ab') as tpo:
+        for start in range(0, len(data), CHUNK_BARS):
+            chunk = data[start:start + CHUNK_BARS]
+            chunk_volume, chunk_tpo = _bar_rows(chunk, meta['origin'], levels, meta['tick_size'])
+            chunk_volume = volume_total + np.cumsum(chunk_volume, axis=0)
+            chunk_tpo = tpo_total + np.cumsum(chunk_tpo, axis=0, dtype=np.int32)
+            times.write(np.ascontiguousarray(chunk['timestamp'], dtype=np.int64).tobytes())
+            volume.write(chunk_volume.tobytes())
+            tpo.write(chunk_tpo.tobytes())
+            volume_total, tpo_total = chunk_volume[-1], chunk_tpo[-1]
+    meta = dict(meta, rows=meta['rows'] + len(data))
+    _save_meta(directory, meta)
+    return meta
+
+
+def _save_meta(directory, meta):
+    # The row count is committed last, so readers never map a half-written row
+    with open(os.path.join(directory, 'meta.json.tmp'), 'w') as f:
+        json.dump(meta, f)
+    os.replace(os.path.join(directory, 'meta.json.tmp'), os.path.join(directory, 'meta.json'))
+
+
+def build_index(directory, data, interval, tick_size, margin=0.25):
+    """
+    Build an index from scratch out of a KLINE_DTYPE array
+
+    :param margin: Extra price range kept on both sides of the data, as a
+        fraction of its range, so later bars rarely force a rebuild
+    :return: ProfileIndex
+    """
+    if not len(data):
+        raise ValueError("No bars to index")
+    os.makedirs(directory, exist_ok=True)
+    grid = PriceGrid(tick_size)
+    low = grid.level(data['low'].min())
+    high = grid.level(data['high'].max())
+    pad = int((high - low) * margin)
+    meta = {'interval': interval, 'tick_size': tick_size, 'origin': int(low - pad),
+            'levels': int(high - low + 1 + 2 * pad), 'rows': 1}
+    for name in ('times.i8', 'volume.f8', 'tpo.i4'):
+        open(os.path.join(directory, name), 'wb').close()
+    # Row 0 is all zeros: the totals before the first bar
+    with open(os.path.join(directory, 'volume.f8'), 'wb') as f:
+        f.write(np.zeros(meta['levels']).tobytes())
+    with open(os.path.join(directory, 'tpo.i4'), 'wb') as f:
+        f.write(np.zeros(meta['levels'], dtype=np.int32).tobytes())
+    _save_meta(directory, meta)
+    _append(directory, meta, data)
+    return ProfileIndex(directory)
+
+
+def update_index(symbol, interval, tick_size, start_time, root=None):
+    """
+    Bring the on-disk index of a symbol up to the last closed bar
+
+    Only bars after the last indexed one are appended; bars outside the price
+    grid trigger a rebuild with a wider grid.
+
+    :param start_time: First bar of the index when it is built from scratch
+    :return: ProfileIndex
+    """
+    directory = index_dir(symbol, interval, tick_size, root)
+    step = store.interval_ms(interval)
+    end_time = store.bar_open_time(int(time.time() * 1000), interval)
+    if not os.path.exists(os.path.join(directory, 'meta.json')):
+        return build_index(directory, bars.history(symbol, interval, start_time, end_time, root), interval, tick_size)
+
+    index = ProfileIndex(directory)
+    first = int(index.times[0]) if len(index.times) else start_time
+    last = int(index.times[-1]) + step if len(index.times) else start_time
+    new = bars.history(symbol, interval, last, end_time, root)
+    if not len(new):
+        return index
+    levels = PriceGrid(tick_size).level(np.r_[new['low'], new['high']]) - index.meta['origin']
+    if levels.min() < 0 or levels.max() >= index.meta['levels']:
+        return build_index(directory, bars.history(symbol, interval, first, end_time, root), interval, tick_size)
+    _append(directory, index.meta, new)
+    return ProfileIndex(directory)
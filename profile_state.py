@@ -0,0 +1,252 @@
+import os
+import json
+import time
+import numpy as np
+import pandas as pd
+import store
+import bars
+from value_area import poc_and_value_area
+from price_grid import PriceGrid
+
+HOUR_MS = 3600 * 1000
+
+
+class Profile:
+    """
+    Tick-level volume histogram and TPO counts of one session, or of several merged
+
+    Volume goes to each bar's close level, like calculate_session_volume_profile;
+    every bar adds one TPO to each level of its low-high range.
+    """
+    def __init__(self, tick_size):
+        self.tick_size = tick_size
+        self.grid = PriceGrid(tick_size)
+        self.origin = 0
+        self.volume = np.zeros(0)
+        self.tpo = np.zeros(0, dtype=np.int64)
+        self.start_time = None
+        self.end_time = None
+        self.open = self.high = self.low = self.close = np.nan
+
+    @property
+    def price_levels(self):
+        return self.grid.price(self.origin + np.arange(len(self.volume)))
+
+    def _grow(self, low, high):
+        # Pad the arrays so levels low..high fit, keeping existing counts in place
+        if not len(self.volume):
+            self.origin = int(low)
+            self.volume = np.zeros(high - low + 1)
+            self.tpo = np.zeros(high - low + 1, dtype=np.int64)
+            return
+        origin = min(self.origin, int(low))
+        end = max(self.origin + len(self.volume), int(high) + 1)
+        if origin == self.origin and end == self.origin + len(self.volume):
+            return
+        volume = np.zeros(end - origin)
+        tpo = np.zeros(end - origin, dtype=np.int64)
+        volume[self.origin - origin:self.origin - origin + len(self.volume)] = self.volume
+        tpo[self.origin - origin:self.origin - origin + len(self.tpo)] = self.tpo
+        self.origin, self.volume, self.tpo = origin, volume, tpo
+
+    def _extend(self, start_time, end_time, open_, high, low, close):
+        if self.start_time is None or start_time < self.start_time:
+            self.start_time, self.open = start_time, open_
+        if self.end_time is None or end_time >= self.end_time:
+            self.end_time, self.close = end_time, close
+        self.high = np.nanmax([self.high, high])
+        self.low = np.nanmin([self.low, low])
+
+    def add(self, data):
+        """
+        Fold KLINE_DTYPE bars into the profile
+        """
+        if not len(data):
+            return self
+        low = self.grid.level(data['low'])
+        high = self.grid.level(data['high'])
+        close = self.grid.level(data['close'])
+        self._grow(low.min(), high.max())
+        n = len(self.volume)
+        self.volume += np.bincount(close - self.origin, data['volume'], n)
+        diff = np.bincount(low - self.origin, minlength=n + 1) - np.bincount(high - self.origin + 1, minlength=n + 1)
+        self.tpo += np.cumsum(diff[:-1])
+        self._extend(int(data['timestamp'][0]), int(data['timestamp'][-1]), data['open'][0],
+                     data['high'].max(), data['low'].min(), data['close'][-1])
+        return self
+
+    def merge(self, other):
+        """
+        New profile holding both profiles' counts, e.g. sessions into a weekly composite
+        """
+        merged = Profile(self.tick_size)
+        for profile in (self, other):
+            if not len(profile.volume):
+                continue
+            merged._grow(profile.origin, profile.origin + len(profile.volume) - 1)
+            offset = profile.origin - merged.origin
+            merged.volume[offset:offset + len(profile.volume)] += profile.volume
+            merged.tpo[offset:offset + len(profile.tpo)] += profile.tpo
+            merged._extend(profile.start_time, profile.end_time, profile.open, profile.high, profile.low, profile.close)
+        return merged
+
+    def value_area(self, value_area=0.7, by='volume'):
+        """
+        :return: (POC, value area low, value area high) prices
+        """
+        poc, low, high = poc_and_value_area(self.volume if by == 'volume' else self.tpo, value_area)
+        levels = self.price_levels
+        return levels[poc], levels[low], levels[high]
+
+    def save(self, path):
+        with open(path + '.tmp', 'wb') as f:
+            np.savez(f, volume=self.volume, tpo=self.tpo,
+                     meta=np.array([self.tick_size, self.origin, self.start_time, self.end_time,
+                                    self.open, self.high, self.low, self.close], dtype=float))
+        os.replace(path + '.tmp', path)
+
+
+def load_profile(path):
+    with np.load(path) as data:
+        tick_size, origin, start_time, end_time, open_, high, low, close = data['meta']
+        profile = Profile(tick_size)
+        profile.origin = int(origin)
+        profile.volume = data['volume']
+        profile.tpo = data['tpo']
+    profile.start_time, profile.end_time = int(start_time), int(end_time)
+    profile.open, profile.high, profile.low, profile.close = open_, high, low, close
+    return profile
+
+
+def merge(profiles):
+    profiles = list(profiles)
+    merged = profiles[0]
+    for profile in profiles[1:]:
+        merged = merged.merge(profile)
+    return merged
+
+
+class SessionProfiles:
+    """
+    Persistent per-session profiles of one symbol
+
+    Each session is a daily window of `session_hours` starting at
+    `session_start` (UTC). Bars are folded in once: a high-water mark records
+    the last bar seen, so an update only touches the open session, and
+    closed sessions stay as they were written.
+    """
+    def __init__(self, symbol, tick_size, session_start='00:00', session_hours=8, root=None):
+        self.symbol = symbol
+        self.tick_size = tick_size
+        self.root = root
+        hours, minutes = (int(part) for part in session_start.split(':'))
+        self.offset = (hours * 60 + minutes) * 60 * 1000
+        self.length = int(session_hours * HOUR_MS)
+        self.directory = store.partition_dir(
+            symbol, f"sessions_{hours:02d}{minutes:02d}_{session_hours:g}h_{tick_size:g}", root)
+        os.makedirs(self.directory, exist_ok=True)
+        self.state_path = os.path.join(self.directory, 'state.json')
+        self.high_water = -1
+        if os.path.exists(self.state_path):
+            with open(self.state_path) as f:
+                self.high_water = json.load(f)['high_water']
+
+    def _path(self, session):
+        return os.path.join(self.directory, f"{session}.npz")
+
+    def session_of(self, timestamps):
+        # Session start for each timestamp, -1 outside every session
+        timestamps = np.asarray(timestamps, dtype=np.int64)
+        start = (timestamps - self.offset) // store.DAY_MS * store.DAY_MS + self.offset
+        return np.where(timestamps - start < self.length, start, -1)
+
+    def is_closed(self, session):
+        return session + self.length <= self.high_water
+
+    def sessions(self, start_time=None, end_time=None):
+        keys = sorted(int(name[:-4]) for name in os.listdir(self.directory) if name.endswith('.npz'))
+        return [key for key in keys
+                if (start_time is None or key >= start_time) and (end_time is None or key < end_time)]
+
+    def load(self, session):
+        path = self._path(session)
+        return load_profile(path) if os.path.exists(path) else Profile(self.tick_size)
+
+    def update(self, data):
+        """
+        Fold bars newer than the high-water mark into their sessions
+
+        :param data: KLINE_DTYPE array of closed bars sorted by open time
+        :return: Session starts that changed
+        """
+        data = data[data['timestamp'] > self.high_water]
+        if not len(data):
+            return []
+        keys = self.session_of(data['timestamp'])
+        changed = [int(key) for key in np.unique(keys[keys >= 0])]
+        for key in changed:
+            self.load(key).add(data[keys == key]).save(self._path(key))
+        self.high_water = int(data['timestamp'][-1])
+        with open(self.state_path + '.tmp', 'w') as f:
+            json.dump({'high_water': self.high_water}, f)
+        os.replace(self.state_path + '.tmp', self.state_path)
+        return changed
+
+    def new_bars(self, interval, start_time):
+        """
+        Closed bars not folded in yet, from bars.history
+
+        :param start_time: Where the history starts when the state is empty
+        """
+        step = store.interval_ms(interval)
+        end_time = store.bar_open_time(int(time.time() * 1000), interval)
+        start_time = max(start_time, self.high_water + step) if self.high_water >= 0 else start_time
+        return bars.history(self.symbol, interval, store.bar_open_time(start_time, interval), end_time, self.root)
+
+    def composite(self, start_time=None, end_time=None):
+        """
+        One profile merged from the stored sessions starting in [start_time, end_time);
+        empty if no session starts there
+        """
+        keys = self.sessions(start_time, end_time)
+        if not keys:
+            return Profile(self.tick_size)
+        return merge(self.load(key) for key in keys)
+
+    def to_frame(self, sessions=None, value_area=0.7):
+        """
+        One row per session in the layout of calculate_session_volume_profile,
+        with every profile laid out on the same tick grid
+        """
+        keys = self.sessions() if sessions is None else sessions
+        if not len(keys):
+            return pd.DataFrame(columns=['session', 'start_time', 'end_time', 'open', 'high', 'low', 'close',
+                                         'volume', 'closed', 'poc', 'value_area_min', 'value_area_max',
+                                         'price_range', 'volume_profile', 'price_bins'])
+        profiles = [self.load(key) for key in keys]
+        origin = min(profile.origin for profile in profiles)
+        end = max(profile.origin + len(profile.volume) for profile in profiles)
+        grid = np.zeros((len(profiles), end - origin))
+        for row, profile in enumerate(profiles):
+            grid[row, profile.origin - origin:profile.origin - origin + len(profile.volume)] = profile.volume
+        price_levels = PriceGrid(self.tick_size).price(origin + np.arange(end - origin))
+        poc, low, high = poc_and_value_area(grid, value_area)
+
+        session_df = pd.DataFrame({
+            'session': pd.to_datetime(keys, unit='ms'),
+            'start_time': pd.to_datetime([profile.start_time for profile in profiles], unit='ms'),
+            'end_time': pd.to_datetime([profile.end_time for profile in profiles], unit='ms'),
+            'open': [profile.open for profile in profiles],
+            'high': [profile.high for profile in profiles],
+            'low': [profile.low for profile in profiles],
+            'close': [profile.close for profile in profiles],
+            'volume': grid.sum(axis=1),
+            'closed': [self.is_closed(key) for key in keys]
+        })
+        session_df['poc'] = price_levels[poc]
+        session_df['value_area_min'] = price_levels[low]
+        session_df['value_area_max'] = price_levels[high]
+        session_df['price_range'] = session_df['high'].max() - session_df['low'].min()
+        session_df['volume_profile'] = list(grid)
+        session_df['price_bins'] = [price_levels] * len(profiles)
+        return session_df
@@ -0,0 +1,343 @@
+import json
+import math
+import time
+import asyncio
+import argparse
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from urllib.parse import urlsplit, parse_qsl
+import pandas as pd
+import store
+import bars
+import CVD
+import footprint
+import market_profile
+import volume_profile
+import vps_tps
+import plotting
+from profile_state import SessionProfiles
+
+# Trade queries end at the last whole minute that is settled on the exchange
+TRADE_INTERVAL = '1m'
+# Points a CVD series is decimated to unless the query asks for more
+CVD_POINTS = 2000
+
+KLINE_INDICATORS = ('footprint', 'market_profile', 'volume_profile', 'session_profile')
+TRADE_INDICATORS = ('cvd', 'trade_footprint', 'metrics')
+
+
+class UnknownIndicator(Exception):
+    pass
+
+
+class LRUCache:
+    """
+    Response bodies keyed by query, evicted least recently used first once
+    their total size passes `max_bytes`
+    """
+    def __init__(self, max_bytes=256 * 2**20):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        body = self.entries.get(key)
+        if body is None:
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return body
+
+    def put(self, key, body):
+        self.pop(key)
+        self.entries[key] = body
+        self.bytes += len(body)
+        while self.bytes > self.max_bytes and len(self.entries) > 1:
+            _, evicted = self.entries.popitem(last=False)
+            self.bytes -= len(evicted)
+
+    def pop(self, key):
+        body = self.entries.pop(key, None)
+        if body is not None:
+            self.bytes -= len(body)
+
+    def invalidate(self, predicate):
+        for key in [key for key in self.entries if predicate(key)]:
+            self.pop(key)
+
+
+def _frame_json(df):
+    return df.to_json(orient='records', date_unit='ms')
+
+
+def _klines_frame(symbol, interval, start_time, end_time):
+    # history() has already stored the bars (derived intervals included); workers never fetch or write
+    return footprint.process_klines_data(store.read(symbol, interval, start_time, end_time))
+
+
+def _trades(symbol, start_time, end_time):
+    trades = store.read(symbol, 'aggTrades', start_time, end_time)
+    if not len(trades):
+        raise ValueError(f"No trades for {symbol} in the window")
+    return trades
+
+
+def compute(indicator, symbol, interval, start_time, end_time, params):
+    """
+    Evaluate one query in a worker process
+
+    The parent has already brought the window into the store, so this only reads.
+
+    :return: Dict of scalar results and 'data', the rows as a JSON string
+    """
+    params = dict(params)
+    tick_size = float(params.get('tick_size', 10))
+    if indicator == 'cvd':
+        df = CVD.calculate_cvd(_trades(symbol, start_time, end_time))
+        df = plotting.decimate_frame(df, 'timestamp', ['cvd', 'price'], int(params.get('points', CVD_POINTS)) // 2)
+        return {'data': _frame_json(df)}
+    if indicator == 'trade_footprint':
+        df = footprint.calculate_trade_footprint(_trades(symbol, start_time, end_time), interval, tick_size)
+        return {'data': _frame_json(df)}
+    if indicator == 'metrics':
+        trades = _trades(symbol, start_time, end_time)
+        # An aggTrade stands for trades f..l, so TPS counts those rather than aggTrades
+        df = pd.DataFrame({'time': pd.to_datetime(trades['T'], unit='ms'),
+                           'trades': trades['l'] - trades['f'] + 1, 'qty': trades['q']})
+        metrics = df.resample(params.get('resolution', '1S'), on='time').agg({'trades': 'sum', 'qty': 'sum'})
+        metrics = metrics.rename(columns={'trades': 'tps', 'qty': 'vps'})
+        stats = {name: float(value) for name, value in vps_tps.get_tps_vps_stats(metrics).items()}
+        return {'stats': stats, 'data': _frame_json(metrics.reset_index())}
+
+    df = _klines_frame(symbol, interval, start_time, end_time)
+    if not len(df):
+        raise ValueError(f"No {interval} bars for {symbol} in the window")
+    if indicator == 'footprint':
+        price_levels = footprint.create_price_levels(df, tick_size)
+        return {'data': _frame_json(footprint.build_footprint_matrix(df, price_levels).to_frame())}
+    if indicator == 'market_profile':
+        summary, _, poc, va_low, va_high = market_profile.create_market_profile(
+            df, tick_size, params.get('tpo_period', '30m'), include_letters=False)
+        return {'poc': poc, 'value_area_low': va_low, 'value_area_high': va_high, 'data': _frame_json(summary)}
+    if indicator == 'volume_profile':
+        price_bins, profile = volume_profile.calculate_volume_profile(
+            df, distribution=params.get('distribution', 'close'), tick_size=tick_size)
+        poc, va_low, va_high = volume_profile.find_poc_and_value_area(price_bins, profile)
+        data = pd.DataFrame({'price': price_bins[:-1], 'volume': profile})
+        return {'poc': poc, 'value_area_low': va_low, 'value_area_high': va_high, 'data': _frame_json(data)}
+    raise ValueError(f"Unknown indicator: {indicator}")
+
+
+def _session_profile(symbol, interval, start_time, end_time, params):
+    # Folds new bars into the persistent session state, so it runs on the serial data thread
+    params = dict(params)
+    state = SessionProfiles(symbol, float(params.get('tick_size', 10)), params.get('session_start', '00:00'),
+                            float(params.get('session_hours', 8)))
+    state.update(state.new_bars(interval, start_time))
+    df = state.to_frame(state.sessions(start_time, end_time))
+    return {'data': _frame_json(df.drop(columns=['volume_profile', 'price_bins']))}
+
+
+def _window(indicator, interval):
+    # Dataset whose new bars move the window of a query: 'aggTrades' or a kline interval
+    return 'aggTrades' if indicator in TRADE_INDICATORS else interval
+
+
+def _step(window):
+    return store.interval_ms(TRADE_INTERVAL if window == 'aggTrades' else window)
+
+
+def _latest_bar(window):
+    # End of the closed history: the open time of the bar forming SETTLE_MS
+    # ago, since the store only marks data older than that as complete
+    now = int(time.time() * 1000) - store.SETTLE_MS
+    return store.bar_open_time(now, TRADE_INTERVAL if window == 'aggTrades' else window)
+
+
+def _ensure(indicator, symbol, interval, start_time, end_time, budget=None):
+    # Fetch whatever the store is missing; runs on one thread so store writes never race
+    if indicator in TRADE_INDICATORS:
+        CVD.load_trades(symbol, start_time, end_time, budget=budget)
+    else:
+        bars.history(symbol, interval, start_time, end_time)
+
+
+def _number(value):
+    # NaN (e.g. the value area of a one-bar window) is not valid JSON
+    value = float(value)
+    return value if math.isfinite(value) else None
+
+
+def _body(meta, result):
+    data = result.pop('data')
+    meta = dict(meta, **{name: _number(value) for name, value in result.items() if name != 'stats'})
+    if 'stats' in result:
+        meta['stats'] = {name: _number(value) for name, value in result['stats'].items()}
+    return (json.dumps(meta)[:-1] + ', "data": ' + data + '}').encode()
+
+
+class IndicatorService:
+    """
+    Resident indicator server: queries are answered from an LRU cache of
+    response bodies, misses are computed on a process pool
+
+    Windows are resolved to absolute, bar-aligned [start, end) ranges of
+    closed bars, so a cached entry stays correct until it is evicted. When a
+    new bar closes, entries that reached the latest bar are dropped and the
+    next "latest N bars" query resolves to the new window.
+
+    :param workers: Worker processes for the computations
+    :param cache_bytes: Size bound of the response cache
+    """
+    def __init__(self, workers=None, cache_bytes=256 * 2**20):
+        self.cache = LRUCache(cache_bytes)
+        self.pool = ProcessPoolExecutor(max_workers=workers)
+        self.data = ThreadPoolExecutor(max_workers=1)
+        # Every cache miss that goes to the API draws on the same request-weight budget
+        self.budget = CVD.RequestBudget()
+        self.pending = {}
+        self.boundaries = {}
+
+    def resolve(self, indicator, query):
+        """
+        Cache key of a query: (indicator, symbol, interval, start, end, params)
+        with the window aligned to bars and ending at the last closed one
+        """
+        if indicator not in KLINE_INDICATORS + TRADE_INDICATORS:
+            raise UnknownIndicator(indicator)
+        symbol = query.pop('symbol', 'BTCUSDT').upper()
+        interval = query.pop('interval', TRADE_INTERVAL if indicator in TRADE_INDICATORS else '15m')
+        window = _window(indicator, interval)
+        step = _step(window)
+        latest = _latest_bar(window)
+        end_time = min(int(query.pop('end', latest)), latest) // step * step
+        if 'start' in query:
+            start_time = int(query.pop('start'))
+        elif 'hours' in query:
+            start_time = end_time - int(float(query.pop('hours')) * 3600 * 1000)
+        else:
+            start_time = end_time - int(query.pop('limit', 1000)) * step
+        start_time = start_time // step * step
+        if start_time >= end_time:
+            raise ValueError("Empty window")
+        self.boundaries.setdefault((symbol, window), latest)
+        return indicator, symbol, interval, start_time, end_time, tuple(sorted(query.items()))
+
+    async def query(self, indicator, query):
+        key = self.resolve(indicator, query)
+        body = self.cache.get(key)
+        if body is not None:
+            return body
+        # Identical queries arriving together share one computation
+        future = self.pending.get(key)
+        if future is None:
+            future = self.pending[key] = asyncio.ensure_future(self._compute(key))
+            future.add_done_callback(lambda _: self.pending.pop(key, None))
+        return await asyncio.shield(future)
+
+    async def _compute(self, key):
+        indicator, symbol, interval, start_time, end_time, params = key
+        loop = asyncio.get_running_loop()
+        if indicator == 'session_profile':
+            result = await loop.run_in_executor(self.data, _session_profile, symbol, interval, start_time, end_time, params)
+        else:
+            await loop.run_in_executor(self.data, _ensure, indicator, symbol, interval, start_time, end_time, self.budget)
+            result = await loop.run_in_executor(self.pool, compute, *key)
+        meta = {'indicator': indicator, 'symbol': symbol, 'interval': interval,
+                'start': start_time, 'end': end_time, 'params': dict(params)}
+        body = _body(meta, result)
+        self.cache.put(key, body)
+        return body
+
+    def invalidate(self, symbol, window, since):
+        # Drop entries of a symbol whose window reached the bar that just closed
+        self.cache.invalidate(lambda key: key[1] == symbol and key[4] >= since and _window(key[0], key[2]) == window)
+
+    async def watch_bars(self, period=1.0):
+        while True:
+            await asyncio.sleep(period)
+            for (symbol, window), boundary in list(self.boundaries.items()):
+                latest = _latest_bar(window)
+                if latest != boundary:
+                    self.boundaries[(symbol, window)] = latest
+                    self.invalidate(symbol, window, boundary)
+
+    def stats(self):
+        return json.dumps({'entries': len(self.cache.entries), 'bytes': self.cache.bytes,
+                           'hits': self.cache.hits, 'misses': self.cache.misses,
+                           'pending': len(self.pending)}).encode()
+
+    async def handle(self, reader, writer):
+        # Minimal HTTP/1.1: GET only, keep-alive until the client closes
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip().lower()
+                status, body = await self.respond(request_line.decode('latin-1'))
+                writer.write(f"HTTP/1.1 {status}\r\nContent-Type: application/json\r\n"
+                             f"Content-Length: {len(body)}\r\n\r\n".encode() + body)
+                await writer.drain()
+                if headers.get('connection') == 'close':
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def respond(self, request_line):
+        try:
+            method, target, _ = request_line.split(' ', 2)
+        except ValueError:
+            return '400 Bad Request', b'{"error": "Malformed request"}'
+        if method != 'GET':
+            return '405 Method Not Allowed', b'{"error": "Only GET is supported"}'
+        url = urlsplit(target)
+        path = url.path.strip('/')
+        if path == 'stats':
+            return '200 OK', self.stats()
+        try:
+            return '200 OK', await self.query(path, dict(parse_qsl(url.query)))
+        except UnknownIndicator:
+            return '404 Not Found', json.dumps({'error': f"Unknown indicator: {path}"}).encode()
+        except ValueError as error:
+            return '400 Bad Request', json.dumps({'error': str(error)}).encode()
+        except Exception as error:
+            return '500 Internal Server Error', json.dumps({'error': repr(error)}).encode()
+
+    async def serve(self, host='127.0.0.1', port=8765):
+        server = await asyncio.start_server(self.handle, host, port)
+        watcher = asyncio.ensure_future(self.watch_bars())
+        print(f"Serving {', '.join(KLINE_INDICATORS + TRADE_INDICATORS)} on http://{host}:{port}")
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            watcher.cancel()
+            self.pool.shutdown()
+            self.data.shutdown()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local indicator query service with an LRU result cache")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--workers', type=int, help="Worker processes for computations")
+    parser.add_argument('--cache-mb', type=int, default=256)
+    args = parser.parse_args()
+    service = IndicatorService(args.workers, args.cache_mb * 2**20)
+    asyncio.run(service.serve(args.host, args.port))
+
+
+if __name__ == "__main__":
+    main()
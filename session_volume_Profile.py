@@ -1,20 +1,13 @@
-import requests
 import pandas as pd
 import numpy as np
+import store
+import instrument
+from columnar import write_table
+from value_area import poc_and_value_area
+from profile_state import SessionProfiles
+from price_grid import PriceGrid
 from datetime import datetime, timedelta
 
-BASE_URL = "https://api.binance.com/api/v3"
-
-def get_klines(symbol, interval, limit):
-    endpoint = f"{BASE_URL}/klines"
-    params = {
-        "symbol": symbol,
-        "interval": interval,
-        "limit": limit
-    }
-    response = requests.get(endpoint, params=params)
-    return response.json()
-
 def process_klines_data(klines):
     df = pd.DataFrame(klines, columns=['timestamp', 'open', 'high', 'low', 'close', 'volume', 
                                        'close_time', 'quote_asset_volume', 'number_of_trades', 
@@ -30,93 +23,70 @@ def define_sessions(df, session_start, session_end):
     df['session'] = df['session'].cumsum()
     return df
 
-def calculate_session_volume_profile(df, num_bins=100):
-    sessions = df['session'].unique()
-    session_data = []
-
+def calculate_session_volume_profile(df, num_bins=100, tick_size=None):
     overall_min = df['low'].min()
     overall_max = df['high'].max()
     price_range = overall_max - overall_min
-
-    for session in sessions:
-        session_df = df[df['session'] == session]
-        session_start = session_df['timestamp'].min()
-        session_end = session_df['timestamp'].max()
-        
+    # With a tick size every session shares the tick grid, so profiles from different runs line up
+    if tick_size is None:
         price_bins = np.linspace(overall_min, overall_max, num_bins)
-        volume_profile = np.zeros(num_bins - 1)
-        
-        for _, row in session_df.iterrows():
-            idx = np.clip(np.digitize(row['close'], price_bins) - 1, 0, num_bins - 2)
-            volume_profile[idx] += row['volume']
-        
-        poc_index = np.argmax(volume_profile)
-        poc_price = price_bins[poc_index]
-        
-        total_volume = np.sum(volume_profile)
-        value_area_threshold = 0.7 * total_volume
-        cumulative_volume = 0
-        value_area_min_index = value_area_max_index = poc_index
-
-        for i in range(len(volume_profile)):
-            lower_index = max(0, poc_index - i)
-            upper_index = min(len(volume_profile) - 1, poc_index + i)
-            
-            if lower_index != poc_index:
-                cumulative_volume += volume_profile[lower_index]
-                if cumulative_volume > value_area_threshold:
-                    value_area_min_index = lower_index
-            
-            if upper_index != poc_index:
-                cumulative_volume += volume_profile[upper_index]
-                if cumulative_volume > value_area_threshold:
-                    value_area_max_index = upper_index
-            
-            if cumulative_volume > value_area_threshold:
-                break
-
-        value_area_min = price_bins[value_area_min_index]
-        value_area_max = price_bins[value_area_max_index]
-        
-        session_data.append({
-            'session': session,
-            'start_time': session_start,
-            'end_time': session_end,
-            'open': session_df['open'].iloc[0],
-            'high': session_df['high'].max(),
-            'low': session_df['low'].min(),
-            'close': session_df['close'].iloc[-1],
-            'volume': session_df['volume'].sum(),
-            'poc': poc_price,
-            'value_area_min': value_area_min,
-            'value_area_max': value_area_max,
-            'price_range': price_range,
-            'volume_profile': volume_profile.tolist(),
-            'price_bins': price_bins.tolist()
-        })
-    
-    return pd.DataFrame(session_data)
+    else:
+        price_bins = PriceGrid(tick_size).edges(overall_min, overall_max)
+    n = len(price_bins) - 1
+
+    # One scatter-add into a (session x bin) histogram for every session at once
+    codes, sessions = pd.factorize(df['session'])
+    idx = np.clip(np.digitize(df['close'].to_numpy(), price_bins) - 1, 0, n - 1)
+    profiles = np.bincount(codes * n + idx, weights=df['volume'].to_numpy(),
+                           minlength=len(sessions) * n).reshape(len(sessions), n)
+
+    session_df = df.groupby(codes).agg(
+        start_time=('timestamp', 'min'),
+        end_time=('timestamp', 'max'),
+        open=('open', 'first'),
+        high=('high', 'max'),
+        low=('low', 'min'),
+        close=('close', 'last'),
+        volume=('volume', 'sum')
+    ).reset_index(drop=True)
+
+    poc_index, value_area_min_index, value_area_max_index = poc_and_value_area(profiles, 0.7)
+
+    session_df.insert(0, 'session', sessions)
+    session_df['poc'] = price_bins[poc_index]
+    session_df['value_area_min'] = price_bins[value_area_min_index]
+    session_df['value_area_max'] = price_bins[value_area_max_index]
+    session_df['price_range'] = price_range
+    # Rows of the histogram, not Python lists, so columnar output can store them natively
+    session_df['volume_profile'] = list(profiles)
+    session_df['price_bins'] = [price_bins] * len(sessions)
+    return session_df
 
 def main():
     symbol = 'BTCUSDT'
     interval = '15m'  
     limit = 1000
-
-    klines = get_klines(symbol, interval, limit)
-    df = process_klines_data(klines)
-
-
-    session_start = pd.to_datetime('00:00:00').time()
-    session_duration = timedelta(hours=8)
-    df = define_sessions(df, session_start, (datetime.combine(datetime.min, session_start) + session_duration).time())
-
-    session_df = calculate_session_volume_profile(df)
+    tick_size = 10
+
+    # Profiles persist between runs; only bars after the last run are fetched and folded in
+    state = SessionProfiles(symbol, tick_size, session_start='00:00', session_hours=8)
+    with instrument.stage('fetch', symbol) as stage:
+        start_time = int(datetime.now().timestamp() * 1000) - limit * store.interval_ms(interval)
+        klines = state.new_bars(interval, start_time)
+        stage.rows = len(klines)
+
+    with instrument.stage('compute', symbol) as stage:
+        state.update(klines)
+        session_df = state.to_frame()
+        stage.rows = len(klines)
     
     print(session_df)
     
 
-    session_df.to_csv("session_volume_profile.csv", index=False)
-    print("Session data saved to session_volume_profile.csv")
+    with instrument.stage('write', symbol) as stage:
+        paths = write_table(session_df, 'session_volume_profile', symbol, time_column='start_time')
+        stage.rows = len(session_df)
+    print(f"Session data saved to {len(paths)} partitions under output/session_volume_profile")
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
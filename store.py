@@ -0,0 +1,186 @@
+import os
+import json
+import time
+import requests
+import numpy as np
+import instrument
+from decode import KLINE_DTYPE, AGG_TRADE_DTYPE, TRADE_DTYPE, decode_klines
+
+BASE_URL = "https://api.binance.com/api/v3"
+STORE_DIR = os.environ.get('TICKLAB_STORE', 'data')
+DAY_MS = 24 * 60 * 60 * 1000
+KLINES_LIMIT = 1000
+# Trades younger than this may not be visible over REST yet, so the range is
+# fetched again on the next run instead of being marked complete
+SETTLE_MS = 5000
+
+_INTERVAL_UNITS = {'s': 1000, 'm': 60 * 1000, 'h': 60 * 60 * 1000, 'd': DAY_MS, 'w': 7 * DAY_MS}
+# Weekly klines open on Monday; the epoch was a Thursday
+_WEEK_OFFSET_MS = 4 * DAY_MS
+
+
+def interval_ms(interval):
+    unit = interval[-1]
+    if unit not in _INTERVAL_UNITS:
+        raise ValueError(f"Unsupported interval: {interval}")
+    return int(interval[:-1]) * _INTERVAL_UNITS[unit]
+
+
+def bar_open_time(timestamp, interval):
+    step = interval_ms(interval)
+    offset = _WEEK_OFFSET_MS if interval.endswith('w') else 0
+    return (timestamp - offset) // step * step + offset
+
+
+def _fields(interval):
+    # (time field, unique key field) of each dataset
+    if interval == 'aggTrades':
+        return 'T', 'a'
+    if interval == 'trades':
+        return 'time', 'id'
+    return 'timestamp', 'timestamp'
+
+
+def _dtype(interval):
+    if interval == 'trades':
+        return TRADE_DTYPE
+    return AGG_TRADE_DTYPE if interval == 'aggTrades' else KLINE_DTYPE
+
+
+def agg_trades_to_array(trades):
+    if isinstance(trades, np.ndarray):
+        return trades
+    out = np.empty(len(trades), dtype=AGG_TRADE_DTYPE)
+    for name in AGG_TRADE_DTYPE.names:
+        out[name] = np.fromiter((t[name] for t in trades), dtype=AGG_TRADE_DTYPE[name], count=len(trades))
+    return out
+
+
+def partition_dir(symbol, interval, root=None):
+    return os.path.join(root or STORE_DIR, symbol, interval)
+
+
+def _day_path(directory, day):
+    return os.path.join(directory, time.strftime('%Y-%m-%d', time.gmtime(day * DAY_MS // 1000)) + '.npy')
+
+
+def _load_coverage(directory):
+    path = os.path.join(directory, 'coverage.json')
+    if not os.path.exists(path):
+        return []
+    with open(path) as f:
+        return [tuple(r) for r in json.load(f)]
+
+
+def _save_coverage(directory, ranges):
+    path = os.path.join(directory, 'coverage.json')
+    with open(path + '.tmp', 'w') as f:
+        json.dump(ranges, f)
+    os.replace(path + '.tmp', path)
+
+
+def _merge_ranges(ranges):
+    merged = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def missing_ranges(symbol, interval, start_time, end_time, root=None):
+    """
+    Return the [start, end) sub-ranges of the window that are not in the store
+    """
+    missing = []
+    cursor = start_time
+    for start, end in _load_coverage(partition_dir(symbol, interval, root)):
+        if end <= cursor:
+            continue
+        if start >= end_time:
+            break
+        if start > cursor:
+            missing.append((cursor, start))
+        cursor = max(cursor, end)
+    if cursor < end_time:
+        missing.append((cursor, end_time))
+    return missing
+
+
+def write(symbol, interval, rows, start_time, end_time, root=None, complete_until=None):
+    """
+    Merge rows into the day partitions and mark [start_time, end_time) as stored
+
+    :param rows: Structured array covering the whole window (may be empty)
+    :param complete_until: Only mark the window complete up to this time
+    """
+    directory = partition_dir(symbol, interval, root)
+    os.makedirs(directory, exist_ok=True)
+    time_field, key_field = _fields(interval)
+    rows = rows[(rows[time_field] >= start_time) & (rows[time_field] < end_time)]
+    days = rows[time_field] // DAY_MS
+    for day in np.unique(days):
+        path = _day_path(directory, day)
+        new = rows[days == day]
+        if os.path.exists(path):
+            new = np.concatenate([np.load(path), new])
+        # np.unique sorts by key, which is also time order for both datasets
+        _, first = np.unique(new[key_field], return_index=True)
+        with open(path + '.tmp', 'wb') as f:
+            np.save(f, new[first])
+        os.replace(path + '.tmp', path)
+    complete_until = end_time if complete_until is None else min(end_time, complete_until)
+    if complete_until > start_time:
+        _save_coverage(directory, _merge_ranges(_load_coverage(directory) + [(start_time, complete_until)]))
+
+
+def read(symbol, interval, start_time, end_time, root=None):
+    """
+    Read the stored rows with start_time <= time < end_time from memory-mapped day files
+    """
+    directory = partition_dir(symbol, interval, root)
+    time_field, _ = _fields(interval)
+    parts = []
+    for day in range(start_time // DAY_MS, (end_time - 1) // DAY_MS + 1):
+        path = _day_path(directory, day)
+        if not os.path.exists(path):
+            continue
+        data = np.load(path, mmap_mode='r')
+        lo, hi = np.searchsorted(data[time_field], [start_time, end_time])
+        parts.append(data[lo:hi])
+    if not parts:
+        return np.empty(0, dtype=_dtype(interval))
+    return np.concatenate(parts)
+
+
+def load(symbol, interval, start_time, end_time, fetch, root=None):
+    """
+    Read a window from the store, fetching and storing only the missing ranges first
+
+    :param fetch: Callable (start_time, end_time) -> structured array of rows
+    """
+    settled = int(time.time() * 1000) - SETTLE_MS
+    for start, end in missing_ranges(symbol, interval, start_time, end_time, root):
+        write(symbol, interval, fetch(start, end), start, end, root, complete_until=settled)
+    return read(symbol, interval, start_time, end_time, root)
+
+
+def fetch_klines(symbol, interval, start_time, end_time):
+    pages = []
+    while start_time < end_time:
+        params = {
+            "symbol": symbol,
+            "interval": interval,
+            "startTime": start_time,
+            "endTime": end_time - 1,
+            "limit": KLINES_LIMIT
+        }
+        response = requests.get(f"{BASE_URL}/klines", params=params)
+        instrument.count_request(len(response.content))
+        page = decode_klines(response.content)
+        if len(page) == 0:
+            break
+        pages.append(page)
+        start_time = int(page['timestamp'][-1]) + interval_ms(interval)
+    return np.concatenate(pages) if pages else np.empty(0, dtype=KLINE_DTYPE)
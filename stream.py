@@ -0,0 +1,206 @@
+import sys
+import json
+import queue
+import socket
+import argparse
+import store
+from price_grid import PriceGrid
+from vps_tps import RollingMetrics
+
+
+class CVDState:
+    # Running cumulative volume delta, same sign rule as CVD.calculate_cvd
+    def __init__(self):
+        self.cvd = 0.0
+        self.price = None
+        self.timestamp = None
+
+    def update(self, timestamp, price, qty, is_buyer_maker):
+        self.cvd += -qty if is_buyer_maker else qty
+        self.price = price
+        self.timestamp = timestamp
+
+
+class MetricsState:
+    # Per-second trade count and volume, the buckets of vps_tps.calculate_metrics
+    def __init__(self, on_second=None):
+        self.second = None
+        self.tps = 0
+        self.vps = 0.0
+        self.on_second = on_second
+
+    def update(self, timestamp, qty):
+        second = timestamp // 1000
+        if second != self.second:
+            if self.second is not None and self.on_second is not None:
+                self.on_second(self.second, self.tps, self.vps)
+            self.second = second
+            self.tps = 0
+            self.vps = 0.0
+        self.tps += 1
+        self.vps += qty
+
+
+class FootprintBarState:
+    # The open footprint bar: OHLCV plus bid/ask volume per tick level
+    def __init__(self, interval, tick_size):
+        self.interval_ms = store.interval_ms(interval)
+        self.tick_size = tick_size
+        self.grid = PriceGrid(tick_size)
+        self.bar = None
+
+    def _open(self, bar, price):
+        self.bar = bar
+        self.open = self.high = self.low = self.close = price
+        self.volume = 0.0
+        self.delta = 0.0
+        self.trades = 0
+        self.levels = {}
+
+    def update(self, timestamp, price, qty, is_buyer_maker):
+        # Returns the closed bar when this trade opens a new one
+        bar = timestamp // self.interval_ms
+        closed = None
+        if bar != self.bar:
+            if self.bar is not None:
+                closed = self.snapshot()
+            self._open(bar, price)
+        self.high = max(self.high, price)
+        self.low = min(self.low, price)
+        self.close = price
+        self.volume += qty
+        self.delta += -qty if is_buyer_maker else qty
+        self.trades += 1
+        level = self.grid.level_of(price)
+        cell = self.levels.get(level)
+        if cell is None:
+            cell = self.levels[level] = [0.0, 0.0]
+        # Buyer is the maker -> the aggressor sold into the bid
+        cell[0 if is_buyer_maker else 1] += qty
+        return closed
+
+    def snapshot(self):
+        return {
+            'timestamp': self.bar * self.interval_ms,
+            'open': self.open,
+            'high': self.high,
+            'low': self.low,
+            'close': self.close,
+            'volume': self.volume,
+            'delta': self.delta,
+            'trades': self.trades,
+            'footprint': [
+                {'price': self.grid.price(level).item(), 'bid_volume': bid, 'ask_volume': ask}
+                for level, (bid, ask) in sorted(self.levels.items())
+            ]
+        }
+
+
+class SymbolStream:
+    def __init__(self, symbol, interval, tick_size):
+        self.symbol = symbol
+        self.cvd = CVDState()
+        self.rates = RollingMetrics()
+        self.metrics = MetricsState(on_second=self.rates.update)
+        self.bar = FootprintBarState(interval, tick_size)
+
+    def update(self, timestamp, price, qty, is_buyer_maker):
+        closed = self.bar.update(timestamp, price, qty, is_buyer_maker)
+        # Flushes the previous second into the rolling rates; this trade's second stays open
+        self.metrics.update(timestamp, qty)
+        if closed is not None:
+            # CVD as of the close, before this trade from the next bar is counted
+            closed['symbol'] = self.symbol
+            closed['cvd'] = self.cvd.cvd
+            closed['rates'] = {window: self.rates.stats(window) for window in self.rates.windows}
+        self.cvd.update(timestamp, price, qty, is_buyer_maker)
+        return closed
+
+
+class StreamPipeline:
+    """
+    Incremental CVD, per-second TPS/VPS and footprint bars over an aggTrade feed
+
+    :param interval: Footprint bar interval, e.g. '1m'
+    :param tick_size: Footprint price level size
+    :param on_bar: Called with a snapshot dict each time a bar closes
+    """
+    def __init__(self, interval='1m', tick_size=10, on_bar=None):
+        self.interval = interval
+        self.tick_size = tick_size
+        self.on_bar = on_bar
+        self.symbols = {}
+
+    def process(self, event):
+        # Accepts raw or combined-stream websocket aggTrade payloads
+        trade = event.get('data', event)
+        symbol = trade['s']
+        state = self.symbols.get(symbol)
+        if state is None:
+            state = self.symbols[symbol] = SymbolStream(symbol, self.interval, self.tick_size)
+        closed = state.update(int(trade['T']), float(trade['p']), float(trade['q']), trade['m'])
+        if closed is not None and self.on_bar is not None:
+            self.on_bar(closed)
+        return closed
+
+    def run(self, source):
+        for event in source:
+            self.process(event)
+
+
+def replay_file(path):
+    # One aggTrade JSON object per line, e.g. a recorded websocket session
+    with open(path) as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def socket_source(host, port):
+    # Newline-delimited aggTrade JSON over TCP
+    with socket.create_connection((host, port)) as conn:
+        for line in conn.makefile('r'):
+            if line.strip():
+                yield json.loads(line)
+
+
+def websocket_source(symbols):
+    from binance import ThreadedWebsocketManager
+    messages = queue.Queue()
+    manager = ThreadedWebsocketManager()
+    manager.start()
+    manager.start_multiplex_socket(callback=messages.put,
+                                   streams=[f"{symbol.lower()}@aggTrade" for symbol in symbols])
+    try:
+        while True:
+            yield messages.get()
+    finally:
+        manager.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Stream CVD, TPS/VPS and footprint bars from aggTrades")
+    parser.add_argument('--replay', help="aggTrade JSON lines file to replay")
+    parser.add_argument('--socket', help="host:port serving aggTrade JSON lines")
+    parser.add_argument('--symbols', nargs='+', default=['BTCUSDT'], help="Symbols for the live websocket feed")
+    parser.add_argument('--interval', default='1m')
+    parser.add_argument('--tick-size', type=float, default=10)
+    args = parser.parse_args()
+
+    if args.replay:
+        source = replay_file(args.replay)
+    elif args.socket:
+        host, port = args.socket.rsplit(':', 1)
+        source = socket_source(host, int(port))
+    else:
+        source = websocket_source(args.symbols)
+
+    def print_bar(snapshot):
+        sys.stdout.write(json.dumps(snapshot) + '\n')
+        sys.stdout.flush()
+
+    StreamPipeline(args.interval, args.tick_size, on_bar=print_bar).run(source)
+
+
+if __name__ == "__main__":
+    main()
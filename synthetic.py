@@ -0,0 +1,134 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qsl
+import numpy as np
+import pandas as pd
+import store
+from decode import KLINE_DTYPE, AGG_TRADE_DTYPE, TRADE_DTYPE
+
+START_TIME = 1704067200000  # 2024-01-01 00:00 UTC
+
+
+def agg_trades(n, seed=0, start_time=START_TIME, price=60000.0, tick=0.01, trades_per_second=50):
+    """
+    Seeded aggTrades with bursty arrivals, a random-walk price and heavy-tailed sizes
+
+    :return: AGG_TRADE_DTYPE structured array sorted by time
+    """
+    rng = np.random.default_rng(seed)
+    # Activity regimes change every ~1000 trades, so some seconds are quiet and some busy
+    rate = trades_per_second * np.repeat(rng.lognormal(0, 0.8, n // 1000 + 1), 1000)[:n]
+    gaps = rng.exponential(1000 / rate)
+    prices = price + np.cumsum(rng.normal(0, tick * 20, n))
+    # Aggressor side is sticky: runs of buys and sells, not coin flips
+    flips = rng.random(n) < 0.2
+    side = (np.cumsum(flips) + rng.integers(0, 2)) % 2 == 1
+
+    out = np.empty(n, dtype=AGG_TRADE_DTYPE)
+    out['a'] = np.arange(n)
+    out['p'] = np.round(np.maximum(prices, tick) / tick) * tick
+    out['q'] = np.round(rng.lognormal(-4, 1.5, n), 5) + 0.00001
+    out['f'] = np.arange(n)
+    out['l'] = np.arange(n)
+    out['T'] = start_time + np.cumsum(gaps).astype(np.int64)
+    out['m'] = side
+    out['M'] = True
+    return out
+
+
+def trades(n, seed=0, **kwargs):
+    """
+    Same stream in the /trades layout used by vps_tps
+    """
+    agg = agg_trades(n, seed, **kwargs)
+    out = np.empty(n, dtype=TRADE_DTYPE)
+    out['id'] = agg['a']
+    out['price'] = agg['p']
+    out['qty'] = agg['q']
+    out['quoteQty'] = agg['p'] * agg['q']
+    out['time'] = agg['T']
+    out['isBuyerMaker'] = agg['m']
+    out['isBestMatch'] = True
+    return out
+
+
+def klines(n, interval='1m', seed=0, start_time=START_TIME, price=60000.0):
+    """
+    Seeded klines with a random-walk close, wicks and a taker buy share per bar
+
+    :return: KLINE_DTYPE structured array, the same layout as bars.get_bars
+    """
+    rng = np.random.default_rng(seed)
+    step = store.interval_ms(interval)
+    scale = price * 0.0005 * np.sqrt(step / 60000)
+    close = price + np.cumsum(rng.normal(0, scale, n))
+    open_ = np.concatenate([[price], close[:-1]])
+    volume = rng.lognormal(3, 1, n) * step / 60000
+    taker_buy = volume * rng.uniform(0.3, 0.7, n)
+
+    out = np.empty(n, dtype=KLINE_DTYPE)
+    out['timestamp'] = start_time + np.arange(n) * step
+    out['open'] = open_
+    out['high'] = np.maximum(open_, close) + rng.exponential(scale / 2, n)
+    out['low'] = np.minimum(open_, close) - rng.exponential(scale / 2, n)
+    out['close'] = close
+    out['volume'] = volume
+    out['close_time'] = out['timestamp'] + step - 1
+    out['quote_asset_volume'] = volume * close
+    out['number_of_trades'] = rng.poisson(volume * 10) + 1
+    out['taker_buy_base_asset_volume'] = taker_buy
+    out['taker_buy_quote_asset_volume'] = taker_buy * close
+    out['ignore'] = 0
+    return out
+
+
+def klines_frame(n, interval='1m', seed=0):
+    # The frame every kline script builds in process_klines_data
+    data = klines(n, interval, seed)
+    df = pd.DataFrame({name: data[name] for name in
+                       ['timestamp', 'open', 'high', 'low', 'close', 'volume', 'taker_buy_base_asset_volume']})
+    df['timestamp'] = pd.to_datetime(df['timestamp'], unit='ms')
+    df['taker_sell_base_asset_volume'] = df['volume'] - df['taker_buy_base_asset_volume']
+    return df
+
+
+def serve_agg_trades(data, port=0):
+    """
+    Local stand-in for Binance's /api/v3/aggTrades serving `data`, for
+    running CVD.RestClient(server.base_url) and the fetch paths offline
+
+    Follows the API's paging rules: startTime/endTime are inclusive,
+    fromId starts at an aggTrade id and limit caps a page at 1000.
+
+    :param data: AGG_TRADE_DTYPE array sorted by id
+    :return: Running server with a base_url attribute; call shutdown() when done
+    """
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            url = urlsplit(self.path)
+            params = dict(parse_qsl(url.query))
+            rows = data
+            if 'fromId' in params:
+                rows = rows[rows['a'] >= int(params['fromId'])]
+            if 'startTime' in params:
+                rows = rows[rows['T'] >= int(params['startTime'])]
+            if 'endTime' in params:
+                rows = rows[rows['T'] <= int(params['endTime'])]
+            rows = rows[:min(int(params.get('limit', 500)), 1000)]
+            body = json.dumps([{'a': int(row['a']), 'p': f"{row['p']:.8f}", 'q': f"{row['q']:.8f}",
+                                'f': int(row['f']), 'l': int(row['l']), 'T': int(row['T']),
+                                'm': bool(row['m']), 'M': bool(row['M'])} for row in rows]).encode()
+            self.send_response(200 if url.path.endswith('/aggTrades') else 404)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', port), Handler)
+    server.base_url = f"http://127.0.0.1:{server.server_address[1]}"
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
@@ -0,0 +1,56 @@
+import numpy as np
+
+
+def poc_and_value_area(profiles, value_area=0.7, method='larger'):
+    """
+    POC and value area bin indices for a stack of volume profiles
+
+    The value area starts at the POC bin and grows until it holds
+    `value_area` of the profile's total volume.
+
+    :param profiles: 2D array (profiles x bins), or a single 1D profile
+    :param value_area: Fraction of total volume inside the value area
+    :param method: 'larger' adds whichever neighbouring bin has more volume
+        first (the standard rule), 'lockstep' widens both sides by one bin per step
+    :return: Tuple of (poc, value area low, value area high) bin indices
+    """
+    profiles = np.asarray(profiles, dtype=float)
+    single = profiles.ndim == 1
+    profiles = np.atleast_2d(profiles)
+    num_profiles, num_bins = profiles.shape
+    rows = np.arange(num_profiles)
+
+    poc = np.argmax(profiles, axis=1)
+    target = value_area * profiles.sum(axis=1)
+
+    if method == 'lockstep':
+        # Volume inside [poc - k, poc + k] for every k from one prefix sum
+        prefix = np.zeros((num_profiles, num_bins + 1))
+        np.cumsum(profiles, axis=1, out=prefix[:, 1:])
+        k = np.arange(num_bins)
+        low = np.maximum(poc[:, None] - k, 0)
+        high = np.minimum(poc[:, None] + k, num_bins - 1)
+        inside = prefix[rows[:, None], high + 1] - prefix[rows[:, None], low]
+        steps = np.argmax(inside >= target[:, None], axis=1)
+        low, high = low[rows, steps], high[rows, steps]
+    elif method == 'larger':
+        low, high = poc.copy(), poc.copy()
+        inside = profiles[rows, poc]
+        # One bin per step for every unfinished profile, at most num_bins - 1 steps
+        while True:
+            active = (inside < target) & ((low > 0) | (high < num_bins - 1))
+            if not active.any():
+                break
+            below = np.where(low > 0, profiles[rows, np.maximum(low - 1, 0)], -np.inf)
+            above = np.where(high < num_bins - 1, profiles[rows, np.minimum(high + 1, num_bins - 1)], -np.inf)
+            take_above = active & (above > below)
+            take_below = active & ~take_above
+            inside = inside + np.where(take_above, above, 0) + np.where(take_below, below, 0)
+            high = high + take_above
+            low = low - take_below
+    else:
+        raise ValueError(f"Unknown method: {method}")
+
+    if single:
+        return poc[0], low[0], high[0]
+    return poc, low, high
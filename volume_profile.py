@@ -1,21 +1,14 @@
-import requests
 import pandas as pd
 import numpy as np
+from bars import get_bars
+import instrument
+import plotting
 import matplotlib.pyplot as plt
+import os
+from value_area import poc_and_value_area
+from price_grid import PriceGrid
 from datetime import datetime, timedelta
 
-BASE_URL = "https://api.binance.com/api/v3"
-
-def get_klines(symbol, interval, limit):
-    endpoint = f"{BASE_URL}/klines"
-    params = {
-        "symbol": symbol,
-        "interval": interval,
-        "limit": limit
-    }
-    response = requests.get(endpoint, params=params)
-    return response.json()
-
 def process_klines_data(klines):
     df = pd.DataFrame(klines, columns=['timestamp', 'open', 'high', 'low', 'close', 'volume', 
                                        'close_time', 'quote_asset_volume', 'number_of_trades', 
@@ -25,50 +18,64 @@ def process_klines_data(klines):
     df[['open', 'high', 'low', 'close', 'volume']] = df[['open', 'high', 'low', 'close', 'volume']].astype(float)
     return df
 
-def calculate_volume_profile(df, num_bins=100):
+def _bin_index(prices, price_bins):
+    # Bin of each price; the top edge belongs to the last bin
+    return np.clip(np.digitize(prices, price_bins) - 1, 0, len(price_bins) - 2)
+
+def calculate_volume_profile(df, num_bins=100, distribution='close', tick_size=None):
+    """
+    Volume per price bin
+
+    :param distribution: 'close' puts each bar's volume in its close bin,
+        'uniform' splits it equally over the bins its high-low range covers,
+        'overlap' splits it in proportion to how much of the range falls in each bin
+    :param tick_size: Bin on the shared tick grid instead of `num_bins` bins between the window's extremes
+    :return: Bin edges and volume per bin
+    """
     price_min, price_max = df['low'].min(), df['high'].max()
-    price_bins = np.linspace(price_min, price_max, num_bins)
-    volume_profile = np.zeros(num_bins - 1)
-    
-    for _, row in df.iterrows():
-        idx = np.digitize(row['close'], price_bins) - 1
-        volume_profile[idx] += row['volume']
-    
-    return price_bins, volume_profile
+    if tick_size is None:
+        price_bins = np.linspace(price_min, price_max, num_bins)
+    else:
+        price_bins = PriceGrid(tick_size).edges(price_min, price_max)
+    n = len(price_bins) - 1
+    volume = df['volume'].to_numpy()
+
+    if distribution == 'close':
+        idx = _bin_index(df['close'].to_numpy(), price_bins)
+        return price_bins, np.bincount(idx, weights=volume, minlength=n)
 
-def find_poc_and_value_area(price_bins, volume_profile, value_area_threshold=0.7):
-    poc_index = np.argmax(volume_profile)
-    poc_price = price_bins[poc_index]
-    
-    total_volume = np.sum(volume_profile)
-    threshold = value_area_threshold * total_volume
-    cumulative_volume = 0
-    value_area_min_index = value_area_max_index = poc_index
+    low, high = df['low'].to_numpy(), df['high'].to_numpy()
+    first, last = _bin_index(low, price_bins), _bin_index(high, price_bins)
+    single = first == last
+    if distribution == 'uniform':
+        per_bin = volume / (last - first + 1)
+        first_share = last_share = per_bin
+    elif distribution == 'overlap':
+        span = high - low
+        density = np.divide(volume, span, out=np.zeros(len(df)), where=span > 0)
+        per_bin = density * (price_bins[1] - price_bins[0])
+        first_share = np.where(single, volume, density * (price_bins[first + 1] - low))
+        last_share = np.where(single, 0, density * (high - price_bins[last]))
+    else:
+        raise ValueError(f"Unknown distribution: {distribution}")
 
-    for i in range(len(volume_profile)):
-        lower_index = max(0, poc_index - i)
-        upper_index = min(len(volume_profile) - 1, poc_index + i)
-        
-        if lower_index != poc_index:
-            cumulative_volume += volume_profile[lower_index]
-            if cumulative_volume > threshold:
-                value_area_min_index = lower_index
-        
-        if upper_index != poc_index:
-            cumulative_volume += volume_profile[upper_index]
-            if cumulative_volume > threshold:
-                value_area_max_index = upper_index
-        
-        if cumulative_volume > threshold:
-            break
+    # Prefix-sum trick: +w at the first bin and -w past the last, so the
+    # cumsum spreads w over every bin in between without a per-bar loop
+    diff = np.bincount(first, per_bin, n + 1) - np.bincount(last + 1, per_bin, n + 1)
+    volume_profile = np.cumsum(diff[:-1])
+    # Partially covered edge bins get their own share instead of a full bin
+    volume_profile += np.bincount(first, first_share - per_bin, n)
+    volume_profile += np.bincount(last, np.where(single, 0, last_share - per_bin), n)
+    return price_bins, volume_profile
 
-    value_area_min = price_bins[value_area_min_index]
-    value_area_max = price_bins[value_area_max_index]
-    
-    return poc_price, value_area_min, value_area_max
+def find_poc_and_value_area(price_bins, volume_profile, value_area_threshold=0.7, method='larger'):
+    poc_index, value_area_min_index, value_area_max_index = poc_and_value_area(
+        volume_profile, value_area_threshold, method)
+    return price_bins[poc_index], price_bins[value_area_min_index], price_bins[value_area_max_index]
 
-def plot_volume_profile_and_price(df, price_bins, volume_profile, poc_price, value_area_min, value_area_max, symbol):
+def plot_volume_profile_and_price(df, price_bins, volume_profile, poc_price, value_area_min, value_area_max, symbol, output_dir='output'):
     fig, (ax1, ax2) = plt.subplots(1, 2, figsize=(15, 6), gridspec_kw={'width_ratios': [1, 3]})
+    df = plotting.decimate_frame(df, 'timestamp', ['close'], plotting.pixel_width(fig, ax2))
 
     # Volume profile
     ax1.barh(price_bins[:-1], volume_profile, height=price_bins[1] - price_bins[0], color='lightgray')
@@ -95,18 +102,31 @@ def plot_volume_profile_and_price(df, price_bins, volume_profile, poc_price, val
 
     plt.suptitle('TickLab.IO - Volume Profile', fontsize=16, fontweight='bold')
     plt.tight_layout()
-    plt.show()
+    os.makedirs(output_dir, exist_ok=True)
+    path = os.path.join(output_dir, f'{symbol}_volume_profile.png')
+    plt.savefig(path)
+    plt.close(fig)
+    return path
 
 def main():
     symbol = 'BTCUSDT'
     interval = '1h'
     limit = 1000
+    tick_size = 10
 
-    klines = get_klines(symbol, interval, limit)
-    df = process_klines_data(klines)
-    price_bins, volume_profile = calculate_volume_profile(df)
-    poc_price, value_area_min, value_area_max = find_poc_and_value_area(price_bins, volume_profile)
-    plot_volume_profile_and_price(df, price_bins, volume_profile, poc_price, value_area_min, value_area_max, symbol)
+    with instrument.stage('fetch', symbol) as stage:
+        klines = get_bars(symbol, interval, limit)
+        stage.rows = len(klines)
+    with instrument.stage('parse', symbol) as stage:
+        df = process_klines_data(klines)
+        stage.rows = len(df)
+    with instrument.stage('compute', symbol) as stage:
+        price_bins, volume_profile = calculate_volume_profile(df, tick_size=tick_size)
+        poc_price, value_area_min, value_area_max = find_poc_and_value_area(price_bins, volume_profile)
+        stage.rows = len(df)
+    with instrument.stage('plot', symbol) as stage:
+        plot_volume_profile_and_price(df, price_bins, volume_profile, poc_price, value_area_min, value_area_max, symbol)
+        stage.rows = len(df)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -1,6 +1,11 @@
 import requests
 import pandas as pd
 import numpy as np
+import math
+import store
+import instrument
+from columnar import write_table
+from decode import decode_trades
 from datetime import datetime, timedelta
 
 BASE_URL = "https://api.binance.com/api/v3"
@@ -12,7 +17,8 @@ def get_trades(symbol, limit=1000):
         "limit": limit
     }
     response = requests.get(endpoint, params=params)
-    return response.json()
+    instrument.count_request(len(response.content))
+    return decode_trades(response.content)
 
 def process_trades_data(trades):
     df = pd.DataFrame(trades)
@@ -74,17 +80,145 @@ def get_tps_vps_stats(metrics):
     }
     return stats
 
+class QuantileSketch:
+    """
+    Log-bucketed histogram of non-negative values with relative error `accuracy`
+
+    Counts can be added, removed and merged, so a sketch can track a sliding
+    window and sketches from several windows or symbols can be combined.
+    Memory depends on the value range, not on how many values were added.
+    """
+    def __init__(self, accuracy=0.01):
+        self.accuracy = accuracy
+        self.gamma = (1 + accuracy) / (1 - accuracy)
+        self.log_gamma = math.log(self.gamma)
+        self.zero = 0
+        self.count = 0
+        self.buckets = {}
+
+    def add(self, value, count=1):
+        self.count += count
+        if value <= 0:
+            self.zero += count
+            return
+        key = math.ceil(math.log(value) / self.log_gamma)
+        total = self.buckets.get(key, 0) + count
+        if total:
+            self.buckets[key] = total
+        else:
+            del self.buckets[key]
+
+    def remove(self, value):
+        self.add(value, -1)
+
+    def merge(self, other):
+        self.count += other.count
+        self.zero += other.zero
+        for key, count in other.buckets.items():
+            self.buckets[key] = self.buckets.get(key, 0) + count
+        return self
+
+    def quantile(self, q):
+        if self.count == 0:
+            return float('nan')
+        rank = q * (self.count - 1)
+        seen = self.zero
+        if rank < seen:
+            return 0.0
+        for key in sorted(self.buckets):
+            seen += self.buckets[key]
+            if seen > rank:
+                return 2 * self.gamma ** key / (self.gamma + 1)
+        return 2 * self.gamma ** max(self.buckets) / (self.gamma + 1)
+
+class RollingMetrics:
+    """
+    TPS/VPS over sliding windows from per-second ring buffers
+
+    :param windows: Window lengths, e.g. ('1m', '5m', '1h')
+    :param accuracy: Relative error of the quantile sketches
+    """
+    def __init__(self, windows=('1m', '5m', '1h'), accuracy=0.01):
+        self.windows = {window: store.interval_ms(window) // 1000 for window in windows}
+        self.size = max(self.windows.values())
+        self.accuracy = accuracy
+        self.tps = np.zeros(self.size, dtype=np.int64)
+        self.vps = np.zeros(self.size)
+        self.second = None
+        self._reset()
+
+    def _reset(self):
+        self.filled = 0
+        self.sums = {window: [0, 0.0] for window in self.windows}
+        self.sketches = {window: (QuantileSketch(self.accuracy), QuantileSketch(self.accuracy))
+                         for window in self.windows}
+
+    def _push(self, second, tps, vps):
+        slot = second % self.size
+        for window, length in self.windows.items():
+            sums = self.sums[window]
+            tps_sketch, vps_sketch = self.sketches[window]
+            if self.filled >= length:
+                # The second leaving the window is still in its ring slot
+                old = (second - length) % self.size
+                sums[0] -= self.tps[old]
+                sums[1] -= self.vps[old]
+                tps_sketch.remove(self.tps[old])
+                vps_sketch.remove(self.vps[old])
+            sums[0] += tps
+            sums[1] += vps
+            tps_sketch.add(tps)
+            vps_sketch.add(vps)
+        self.tps[slot] = tps
+        self.vps[slot] = vps
+        self.filled = min(self.filled + 1, self.size)
+
+    def update(self, second, tps, vps):
+        # Seconds must arrive in order; quiet seconds in between count as zero
+        start = second if self.second is None else self.second + 1
+        if second - start >= self.size:
+            self._reset()
+            start = second - self.size + 1
+        for quiet in range(start, second):
+            self._push(quiet, 0, 0.0)
+        self._push(second, tps, vps)
+        self.second = second
+
+    def add_metrics(self, metrics):
+        seconds = metrics.index.asi8 // 10**9
+        for second, tps, vps in zip(seconds, metrics['tps'].to_numpy(), metrics['vps'].to_numpy()):
+            self.update(int(second), int(tps), float(vps))
+
+    def stats(self, window):
+        length = min(self.windows[window], self.filled)
+        tps_sketch, vps_sketch = self.sketches[window]
+        stats = {'seconds': length}
+        for name, total, sketch in (('tps', self.sums[window][0], tps_sketch),
+                                    ('vps', self.sums[window][1], vps_sketch)):
+            # None rather than NaN for an empty window, so snapshots stay valid JSON
+            stats[f'{name}_mean'] = total / length if length else None
+            for q in (50, 95, 99):
+                stats[f'{name}_p{q}'] = sketch.quantile(q / 100) if length else None
+        return stats
+
 def main():
     symbol = 'BTCUSDT'
     limit = 1000  # Number of recent trades to fetch
     interval = '1S'  # Interval for TPS and VPS calculation
 
-    trades = get_trades(symbol, limit)
-    df = process_trades_data(trades)
+    with instrument.stage('fetch', symbol) as stage:
+        trades = get_trades(symbol, limit)
+        stage.rows = len(trades)
+    with instrument.stage('parse', symbol) as stage:
+        df = process_trades_data(trades)
+        stage.rows = len(df)
 
-    tps = calculate_tps(df, interval)
-    vps = calculate_vps(df, interval)
-    metrics = calculate_metrics(df, interval)
+    with instrument.stage('compute', symbol) as stage:
+        # One resample; TPS and VPS are its two columns
+        metrics = calculate_metrics(df, interval)
+        tps = metrics[['tps']]
+        vps = metrics[['vps']]
+        stage.rows = len(df)
 
     print(f"TPS for {symbol}:")
     print(tps.head())
@@ -98,11 +232,18 @@ def main():
     for key, value in stats.items():
         print(f"{key}: {value:.2f}")
 
-    # Save data to CSV
-    tps.to_csv(f"output/{symbol}_tps.csv")
-    vps.to_csv(f"output/{symbol}_vps.csv")
-    metrics.to_csv(f"output/{symbol}_metrics.csv")
-    print("\nData saved to CSV files")
+    rolling = RollingMetrics()
+    rolling.add_metrics(metrics)
+    for window in rolling.windows:
+        print(f"\nRolling {window} window:")
+        for key, value in rolling.stats(window).items():
+            print(f"{key}: {value:.2f}" if value is not None else f"{key}: -")
+
+    # TPS and VPS are columns of the metrics dataset
+    with instrument.stage('write', symbol) as stage:
+        write_table(metrics, 'metrics', symbol, time_column='time')
+        stage.rows = len(metrics)
+    print("\nData saved under output/metrics")
 
 if __name__ == "__main__":
     main()
\ No newline at end of file